@@ -0,0 +1,58 @@
+"""Measure the markdown conversion of posts with many code blocks.
+
+Compares a conversion without any shared pygments state (what every
+conversion used to cost), with shared lexers and formatters but new snippets,
+and with snippets that were highlighted before (e.g. re-saving a post).
+
+    python benchmarks/code_coloring.py [code blocks per post]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from simblin.helpers import MARKDOWN_EXTRAS
+from simblin.lib import markdown2
+
+SNIPPETS = {
+    'python': 'def f(x%d):\n    return [i * 2 for i in range(x)]\n',
+    'javascript': 'function f%d(x) {\n  return x.map(function(i) { '
+                  'return i * 2; });\n}\n',
+    'c': 'int f%d(int x) {\n    return x * 2;\n}\n',
+    'haskell': 'f%d :: Int -> Int\nf x = x * 2\n',
+}
+
+
+def code_heavy_post(blocks, seed=0):
+    """Return markup with the given number of code blocks"""
+    parts = []
+    names = sorted(SNIPPETS)
+    for i in range(blocks):
+        name = names[i % len(names)]
+        code = SNIPPETS[name] % (seed * blocks + i)
+        parts.append('Paragraph number %d.\n\n    :::%s\n%s' % (i, name,
+            ''.join('    ' + line + '\n' for line in code.splitlines())))
+    return '\n'.join(parts)
+
+
+def measure(label, posts, reset):
+    start = time.time()
+    for markup in posts:
+        if reset:
+            markdown2.reset_pygments_cache()
+        markdown2.markdown(markup, extras=MARKDOWN_EXTRAS)
+    per_post = (time.time() - start) / len(posts) * 1000
+    print "%-40s %8.2f ms/post" % (label, per_post)
+
+
+if __name__ == "__main__":
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    runs = 10
+    print "%d posts with %d code blocks each" % (runs, blocks)
+    measure('no shared state', 
+        [code_heavy_post(blocks, i) for i in range(runs)], True)
+    measure('shared lexers/formatters, new snippets',
+        [code_heavy_post(blocks, runs + i) for i in range(runs)], False)
+    measure('shared lexers/formatters, known snippets',
+        [code_heavy_post(blocks, runs) for i in range(runs)], False)
@@ -0,0 +1,247 @@
+"""Measure every public and admin endpoint on a synthetic blog.
+
+Generates a blog in a temporary SQLite database (see synthetic.py), requests
+each endpoint through the test client and reports latency percentiles, the
+number of SQL statements per request and how much the resident memory of the
+process grew while the endpoint was requested. The results can be saved as
+JSON and compared with the results of another version:
+
+    python benchmarks/endpoints.py --posts 2000 --output new.json
+    python benchmarks/endpoints.py --compare old.json
+
+Settings of the app can be changed with --set, e.g. --set PAGE_CACHE=memory.
+"""
+from __future__ import with_statement
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from simblin import create_app
+from simblin.extensions import db, stats
+from simblin.models import Post, Tag, Category
+
+from synthetic import generate
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def resident_memory():
+    """Return the resident memory of the process in kilobytes. Falls back to
+    the peak if /proc is not available"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * resource.getpagesize() // 1024
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def endpoints(requests):
+    """Return a list of (name, method, url, form data, client). The urls
+    point to a post, tag, category and date that exist. The url and the data
+    can be functions of the number of the request for endpoints that change
+    something, like deleting a post. The client is 'anonymous', 'admin' or
+    'session', a client that logs in and out"""
+    post = Post.query.filter_by(visible=True).newest_first().first()
+    slug, date = post.slug, post.datetime
+    tag = Tag.query.order_by(Tag.visible_count.desc()).first()
+    category = Category.query.order_by(Category.visible_count.desc()).first()
+    form = dict(title=post.title, markup=post.markup, tags='tag-1, tag-2',
+        category=category and str(category.id) or '')
+    # The oldest posts are deleted, one per request
+    doomed = [row[0] for row in Post.query.order_by(Post.id)
+              .with_entities(Post._slug).limit(requests + 1)]
+    # Categories get the next free ids, the added ones are deleted again
+    next_category = (db.session.query(db.func.max(Category.id)).scalar()
+                     or 0) + 1
+    credentials = dict(username='admin', password='pw')
+    result = [
+        ('index', 'GET', '/', None, 'anonymous'),
+        ('index page 3', 'GET', '/3', None, 'anonymous'),
+        ('post', 'GET', '/post/%s' % slug, None, 'anonymous'),
+        ('year', 'GET', '/%d/' % date.year, None, 'anonymous'),
+        ('month', 'GET', '/%d/%d/' % (date.year, date.month), None,
+            'anonymous'),
+        ('day', 'GET', '/%d/%d/day/%d/' % (date.year, date.month, date.day),
+            None, 'anonymous'),
+        ('archives', 'GET', '/archives/', None, 'anonymous'),
+        ('feed', 'GET', '/atom', None, 'anonymous'),
+        ('uncategorized', 'GET', '/uncategorized/', None, 'anonymous'),
+        ('search', 'GET', '/search?q=lorem+ipsum', None, 'anonymous'),
+        ('compose', 'GET', '/compose', None, 'admin'),
+        ('edit', 'GET', '/update/%s' % slug, None, 'admin'),
+        ('preview', 'POST', '/_preview', dict(title=form['title'],
+            markup=form['markup'], tags=form['tags'], datetime='0',
+            categories=form['category']), 'admin'),
+        ('update', 'POST', '/update/%s' % slug, dict(title=form['title'],
+            markup=form['markup'], tags=form['tags'], action='Update',
+            visible='1'), 'admin'),
+        ('archives (admin)', 'GET', '/archives/', None, 'admin'),
+    ]
+    if tag:
+        result.append(('tag', 'GET', '/tag/%s/' % tag.name, None,
+            'anonymous'))
+    if category:
+        result.append(('category', 'GET', '/category/%s/' % category.name,
+            None, 'anonymous'))
+    # Endpoints that change the blog come last
+    result += [
+        ('add category', 'POST', '/_add_category',
+            lambda i: dict(name='benchmark-%d' % i), 'admin'),
+        ('delete category', 'POST', '/_delete_category',
+            lambda i: dict(id=str(next_category + i)), 'admin'),
+        ('delete post', 'POST', lambda i: '/_delete/%s' % doomed[i],
+            dict(next=''), 'admin'),
+        ('login', 'POST', '/login', credentials, 'session'),
+        ('logout', 'GET', '/logout', None, 'session'),
+    ]
+    return result
+
+
+def measure(client, method, url, data, requests):
+    """Return the durations in milliseconds, the median number and time of
+    SQL statements and the growth of the resident memory in kilobytes of the
+    requests. The first request is not measured"""
+    def request(i):
+        target = url(i) if callable(url) else url
+        rv = client.open(target, method=method,
+                         data=data(i) if callable(data) else data)
+        # The test client does not buffer, streamed bodies render on reading
+        rv.data
+        if rv.status_code >= 400:
+            raise RuntimeError('%s %s returned %s' % (method, target,
+                                                      rv.status))
+    request(0)
+    stats.reset()
+    memory = resident_memory()
+    durations = []
+    for i in range(1, requests + 1):
+        start = time.time()
+        request(i)
+        durations.append((time.time() - start) * 1000)
+    memory = resident_memory() - memory
+    rows = stats.summary()
+    # Redirects are not followed so all rows belong to the endpoint
+    queries = sum(row['queries'][0] for row in rows)
+    sql = sum(row['sql'][0] for row in rows)
+    return durations, queries, sql, memory
+
+
+def run(options, settings):
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    class Config:
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % path
+        DEBUG = False
+        REQUEST_STATS = True
+        SECRET_KEY = 'benchmark'
+    for key, value in settings.iteritems():
+        setattr(Config, key, value)
+    app = create_app(Config)
+    results = {}
+    try:
+        with app.test_request_context():
+            db.create_all()
+            start = time.time()
+            generate(options.posts, options.tags_per_post, options.tags,
+                options.categories, options.markup_size, options.code_density,
+                options.seed)
+            print "Generated %d posts in %.1f s" % (options.posts,
+                time.time() - start)
+            urls = endpoints(options.requests)
+        generated = resident_memory()
+        clients = dict(anonymous=app.test_client(), admin=app.test_client(),
+                       session=app.test_client())
+        clients['admin'].post('/register', data=dict(username='admin',
+            password='pw', password2='pw', email=''))
+        clients['admin'].post('/login', data=dict(username='admin',
+            password='pw'))
+        print "%-18s %8s %8s %8s %8s %8s %8s" % ('endpoint', 'p50 ms',
+            'p90 ms', 'p99 ms', 'queries', 'sql ms', 'rss kB')
+        for name, method, url, data, client in urls:
+            durations, queries, sql, memory = measure(clients[client],
+                method, url, data, options.requests)
+            result = results[name] = dict(method=method,
+                url=url if not callable(url) else None,
+                p50=percentile(durations, 0.5), p90=percentile(durations, 0.9),
+                p99=percentile(durations, 0.99), queries=queries, sql=sql,
+                memory=memory)
+            print "%-18s %8.2f %8.2f %8.2f %8d %8.2f %8d" % (name,
+                result['p50'], result['p90'], result['p99'], queries, sql,
+                memory)
+    finally:
+        os.remove(path)
+    # Kilobytes on Linux, bytes on OS X
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print "Resident memory after generating: %d kB" % generated
+    print "Peak memory of the process: %d" % peak
+    return dict(options=options.__dict__, settings=settings,
+        python=platform.python_version(), platform=platform.platform(),
+        generated_memory=generated, peak_memory=peak, endpoints=results)
+
+
+def compare(old, new):
+    """Print the change of the median latency, the statements and the
+    memory"""
+    print "\n%-18s %17s %17s %17s" % ('endpoint', 'p50 ms (old/new)',
+        'queries (old/new)', 'rss kB (old/new)')
+    for name in sorted(new['endpoints']):
+        if name not in old['endpoints']:
+            continue
+        a, b = old['endpoints'][name], new['endpoints'][name]
+        print "%-18s %8.2f/%-8.2f %8d/%-8d %8d/%-8d" % (name, a['p50'],
+            b['p50'], a['queries'], b['queries'], a.get('memory', 0),
+            b['memory'])
+
+
+def parse_setting(string):
+    key, value = string.split('=', 1)
+    for constant in (None, True, False):
+        if value == str(constant):
+            return key, constant
+    try:
+        return key, int(value)
+    except ValueError:
+        return key, value
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="python benchmarks/endpoints.py [options]")
+    parser.add_option('--posts', type='int', default=1000)
+    parser.add_option('--tags-per-post', type='int', default=5)
+    parser.add_option('--tags', type='int', default=500)
+    parser.add_option('--categories', type='int', default=20)
+    parser.add_option('--markup-size', type='int', default=2000,
+        help="characters of markup per post")
+    parser.add_option('--code-density', type='float', default=0.1,
+        help="fraction of the blocks of a post that are code")
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--requests', type='int', default=20,
+        help="measured requests per endpoint")
+    parser.add_option('--set', action='append', default=[],
+        metavar='KEY=VALUE', help="change a setting of the app")
+    parser.add_option('--output', help="save the results as JSON")
+    parser.add_option('--compare', metavar='FILE',
+        help="compare with the results of an earlier run")
+    options, args = parser.parse_args()
+    results = run(options, dict(map(parse_setting, options.set)))
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as f:
+            compare(json.load(f), results)
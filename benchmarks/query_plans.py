@@ -0,0 +1,92 @@
+"""Show how the listing indexes change the query plans of the hot queries.
+
+Creates a temporary SQLite database with many posts, removes the indexes to
+get the schema of v0.4, prints the query plan and timing of each query, then
+runs the migrations and prints them again.
+
+    python benchmarks/query_plans.py [number of posts]
+"""
+from __future__ import with_statement
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from simblin import create_app, migrations
+from simblin.extensions import db
+from simblin.models import Post, Tag, post_tags, post_categories
+
+
+def fill(posts, tags=200):
+    """Insert posts with the core API so that filling is fast"""
+    start = datetime(2000, 1, 1)
+    db.engine.execute(Tag.__table__.insert(), 
+        [dict(id=i, name='tag-%d' % i) for i in range(1, tags + 1)])
+    db.engine.execute(Post.__table__.insert(), [dict(id=i, _slug='post-%d' % i,
+        _title='Post %d' % i, _markup='x' * 2000, _html='x' * 2000, 
+        comments_allowed=True, visible=i % 10 != 0, 
+        datetime=start + timedelta(hours=i), modified=start) 
+        for i in range(1, posts + 1)])
+    db.engine.execute(post_tags.insert(), [dict(post_id=i, tag_id=i % tags + 1)
+        for i in range(1, posts + 1)])
+
+
+def queries():
+    """The queries of the listings and the archives"""
+    tag = Tag.query.get(1)
+    visible = Post.query.filter_by(visible=True)
+    return [
+        ('index page', visible.newest_first().limit(5)),
+        ('deep index page', visible.newest_first().limit(5).offset(1000)),
+        ('tag page', Post.query.tagged(tag).filter(Post.visible==True) \
+                        .newest_first().limit(5)),
+        ('month page', visible.filter(Post.datetime >= datetime(2000, 6, 1)) \
+                              .filter(Post.datetime < datetime(2000, 7, 1)) \
+                              .newest_first()),
+    ]
+
+
+def report():
+    connection = db.engine.connect()
+    for name, query in queries():
+        compiled = query.statement.compile(bind=connection)
+        params = [compiled.params[key] for key in compiled.positiontup]
+        plan = connection.execute('EXPLAIN QUERY PLAN ' + unicode(compiled), 
+            params).fetchall()
+        start = time.time()
+        for i in range(20):
+            query.all()
+        print "%-16s %7.2f ms" % (name, (time.time() - start) / 20 * 1000)
+        for row in plan:
+            print "    %s" % list(row)[-1]
+    connection.close()
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    class Config:
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///%s' % path
+        DEBUG = False
+    app = create_app(Config)
+    try:
+        with app.test_request_context():
+            db.create_all()
+            fill(count)
+            for table in Post.__table__, post_tags, post_categories:
+                for index in table.indexes:
+                    index.drop(bind=db.engine)
+            print "Without indexes (v0.4 schema), %d posts:" % count
+            report()
+            connection = db.engine.connect()
+            migrations.migrate(connection)
+            connection.execute('ANALYZE')
+            connection.close()
+            print "\nAfter `manage.py migrate`:"
+            report()
+    finally:
+        os.remove(path)
@@ -0,0 +1,118 @@
+"""Generate a synthetic blog of configurable size.
+
+The rows are inserted with the core API so that large blogs are generated
+quickly. The markup is still converted like when posts are saved and the
+stored counters, the month index and the search index are rebuilt
+afterwards. The same seed always produces the same blog.
+
+Used by benchmarks/endpoints.py. Can also fill the configured database:
+
+    python benchmarks/synthetic.py [number of posts]
+"""
+from __future__ import with_statement
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from simblin.extensions import db
+from simblin.helpers import convert_markup, summarize
+from simblin.search import reindex
+from simblin.models import Post, Tag, Category, Month, post_tags, \
+                           post_categories
+
+from code_coloring import SNIPPETS
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipisicing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+
+def paragraph(rng, size):
+    """Return roughly `size` characters of words"""
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words).capitalize() + '.'
+
+
+def code_block(rng, number):
+    name = rng.choice(sorted(SNIPPETS))
+    code = SNIPPETS[name] % number
+    return '    :::%s\n%s' % (name,
+        ''.join('    ' + line + '\n' for line in code.splitlines()))
+
+
+def markup(rng, size, code_density):
+    """Return markup of about `size` characters. `code_density` is the
+    fraction of the blocks that are highlighted code"""
+    blocks = []
+    length = 0
+    while length < size:
+        if rng.random() < code_density:
+            block = code_block(rng, len(blocks))
+        else:
+            block = paragraph(rng, rng.randint(200, 600))
+        blocks.append(block)
+        length += len(block)
+    return '\n\n'.join(blocks)
+
+
+def generate(posts=1000, tags_per_post=5, tags=500, categories=20,
+             markup_size=2000, code_density=0.1, seed=0):
+    """Fill the empty database of the current app. One in ten posts is
+    hidden and one in ten has no category. Return the number of posts"""
+    rng = random.Random(seed)
+    start = datetime(2005, 1, 1)
+    tag_ids = range(1, tags + 1)
+    category_ids = range(1, categories + 1)
+    db.session.execute(Tag.__table__.insert(),
+        [dict(id=i, name='tag-%d' % i) for i in tag_ids])
+    if categories:
+        db.session.execute(Category.__table__.insert(),
+            [dict(id=i, name='category-%d' % i) for i in category_ids])
+    rows, tag_rows, category_rows = [], [], []
+    for id in range(1, posts + 1):
+        text = markup(rng, markup_size, code_density)
+        date = start + timedelta(hours=id * 7, minutes=rng.randint(0, 59))
+        html = convert_markup(text)
+        summary, summary_text, has_more = summarize(text, html)
+        rows.append(dict(id=id, _slug='post-%d' % id, _title='Post %d' % id,
+            _markup=text, _html=html, _summary=summary, 
+            _summary_text=summary_text, has_more=has_more, 
+            comments_allowed=True, visible=id % 10 != 0, datetime=date, 
+            modified=date))
+        for tag_id in rng.sample(tag_ids, min(tags_per_post, tags)):
+            tag_rows.append(dict(post_id=id, tag_id=tag_id))
+        if categories and id % 10 != 5:
+            for category_id in rng.sample(category_ids,
+                                          rng.randint(1, min(2, categories))):
+                category_rows.append(dict(post_id=id, category_id=category_id))
+    db.session.execute(Post.__table__.insert(), rows)
+    if tag_rows:
+        db.session.execute(post_tags.insert(), tag_rows)
+    if category_rows:
+        db.session.execute(post_categories.insert(), category_rows)
+    Tag.recount()
+    Category.recount()
+    Month.rebuild()
+    db.session.commit()
+    reindex()
+    return posts
+
+
+if __name__ == "__main__":
+    from simblin import create_app
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    app = create_app()
+    with app.test_request_context():
+        db.create_all()
+        if Post.query.count():
+            print "The database is not empty"
+            sys.exit(1)
+        generate(count)
+        print "Generated %d posts" % count
@@ -2,12 +2,21 @@
 from __future__ import with_statement
 import os
 from simblin.extensions import db
-from simblin import create_app
+from simblin import create_app, migrations
 
 app = create_app()
 
 with app.test_request_context():
     # The context is needed so db can access the configuration of the app
+    connection = db.engine.connect()
+    existing = connection.dialect.has_table(connection, 'posts')
     db.create_all()
-
-print "Initialized new empty database in %s" % app.config['SQLALCHEMY_DATABASE_URI']
+    if existing:
+        print "Database already exists. Run `python manage.py migrate` to " \
+              "update its schema"
+    else:
+        # A new database already has the newest schema
+        migrations.stamp(connection)
+        print "Initialized new empty database in %s" % \
+              app.config['SQLALCHEMY_DATABASE_URI']
+    connection.close()
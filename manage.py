@@ -0,0 +1,134 @@
+"""Maintenance commands for an existing blog. Run `python manage.py` to list
+them. The settings are looked up like in initdb.py"""
+from __future__ import with_statement
+import os
+import sys
+from simblin.extensions import db
+from simblin import create_app
+
+commands = []
+
+
+def command(f):
+    """Register a function as a command. The function receives the remaining
+    command line arguments"""
+    commands.append(f)
+    return f
+
+
+@command
+def migrate(args):
+    """Bring the schema of the database up to date"""
+    from simblin import migrations
+    def log(version, migration):
+        print "Applying migration %d: %s" % (version, migration.__doc__)
+    connection = db.engine.connect()
+    try:
+        applied = migrations.migrate(connection, log)
+    finally:
+        connection.close()
+    print "Applied %d migration(s), database is at version %d" % (
+        applied, len(migrations.migrations))
+
+
+@command
+def rerender(args):
+    """Regenerate the html of all posts from their markup"""
+    from optparse import OptionParser
+    from simblin.rerender import rerender
+    parser = OptionParser(usage="python manage.py rerender [options]")
+    parser.add_option('-p', '--processes', type='int', default=None,
+        help="number of worker processes (default: number of cpus)")
+    parser.add_option('-b', '--batch-size', type='int', default=100,
+        help="number of posts written per transaction")
+    parser.add_option('--progress', default='rerender.progress',
+        help="file that records the progress so that a run can be resumed")
+    parser.add_option('--restart', action='store_true', default=False,
+        help="ignore the progress of an interrupted run")
+    options, args = parser.parse_args(args)
+    if options.restart and os.path.exists(options.progress):
+        os.remove(options.progress)
+    def log(total, rate, done=False):
+        if done:
+            print "Rerendered %d post(s) at %.1f posts/s" % (total, rate)
+        else:
+            print "%d post(s) rerendered (%.1f posts/s)" % (total, rate)
+    rerender(options.processes, options.batch_size, options.progress, log)
+    from flask import current_app
+    if current_app.config['PAGE_CACHE'] == 'memory':
+        print "Restart the server to clear its page cache"
+
+
+@command
+def tidy_tags(args):
+    """Delete the tags that are not used by any post"""
+    from simblin.models import Tag
+    count = len(Tag.delete_orphans())
+    db.session.commit()
+    print "Deleted %d unused tag(s)" % count
+
+
+@command
+def repair_counters(args):
+    """Recompute the post counters of all tags and categories"""
+    from simblin.models import Tag, Category
+    Tag.recount()
+    Category.recount()
+    db.session.commit()
+    print "Recomputed the post counters"
+
+
+@command
+def rebuild_months(args):
+    """Recount the posts of every month into the month index"""
+    from simblin.models import Month
+    Month.rebuild()
+    db.session.commit()
+    print "Rebuilt the month index"
+
+
+@command
+def freeze(args):
+    """Export the public pages as static files"""
+    from optparse import OptionParser
+    from flask import current_app
+    from simblin.freeze import Freezer
+    parser = OptionParser(usage="python manage.py freeze [options] directory")
+    parser.add_option('-w', '--workers', type='int', default=4,
+        help="number of threads that render pages")
+    parser.add_option('-i', '--incremental', action='store_true',
+        default=False, help="only render the pages affected by changed posts")
+    options, args = parser.parse_args(args)
+    if len(args) != 1:
+        parser.error("missing the target directory")
+    def log(message):
+        print message
+    # The threads of the freezer need the app itself, not the proxy
+    freezer = Freezer(current_app._get_current_object(), args[0],
+                      options.workers)
+    written, removed = freezer.freeze(options.incremental, log)
+    print "Wrote %d page(s), removed %d page(s)" % (written, removed)
+
+
+@command
+def reindex(args):
+    """Rebuild the search index from all posts"""
+    from simblin.search import reindex
+    print "Indexed %d post(s)" % reindex()
+
+
+def usage():
+    print "Usage: python manage.py <command> [arguments]\n"
+    for f in commands:
+        print "  %-16s%s" % (f.__name__.replace('_', '-'), f.__doc__)
+
+
+if __name__ == "__main__":
+    by_name = dict((f.__name__.replace('_', '-'), f) for f in commands)
+    if len(sys.argv) < 2 or sys.argv[1] not in by_name:
+        usage()
+        sys.exit(1)
+    app = create_app()
+    with app.test_request_context():
+        # The context is needed so db can access the configuration of the app
+        by_name[sys.argv[1]](sys.argv[2:])
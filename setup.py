@@ -15,7 +15,8 @@ setup(
     zip_safe=False,
     install_requires=[
         'Flask',
-        'Flask-SQLAlchemy',
+        # The session of simblin.extensions.SQLAlchemy relies on 0.9
+        'Flask-SQLAlchemy<0.10',
         'blinker',
         'Pygments',
     ],
@@ -11,7 +11,8 @@
 """
 from flask import Flask
 
-from simblin.extensions import db
+from simblin.extensions import db, cache, render_cache, fragment_cache, \
+                               stats, profiler
 from simblin.views.admin import admin
 from simblin.views.main import main
 from simblin.helpers import static
@@ -29,6 +30,11 @@ def create_app(config=None):
         app.config.from_object(config)
     
     db.init_app(app)
+    cache.init_app(app)
+    render_cache.init_app(app)
+    fragment_cache.init_app(app)
+    stats.init_app(app)
+    profiler.init_app(app)
     
     @app.context_processor
     def inject_static():
@@ -0,0 +1,437 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Cache
+    ~~~~~~~~~~~~~
+
+    Caching of rendered pages for visitors that are not logged in,
+    conditional requests, caching of converted markup and of fragments of
+    templates.
+
+    Every cached page remembers the groups it depends on (e.g. the posts it
+    shows or the tag it lists). Each group has a version token in the cache
+    backend. Invalidating a group replaces its token so that all pages that
+    were stored with the old token are treated as missing. This works for
+    backends that are shared between processes, too. The tokens of a page are
+    read when the view registers its groups. Tokens record when they were
+    created, so a page whose groups were invalidated while it was rendered is
+    not stored.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+import os
+from functools import wraps
+from hashlib import md5
+from threading import Lock
+from time import time
+from werkzeug.http import is_resource_modified, quote_etag
+from werkzeug.contrib.cache import BaseCache, NullCache, FileSystemCache
+from jinja2 import nodes
+from jinja2.ext import Extension
+from flask import current_app, request, session, g
+
+from simblin import signals
+
+__all__ = ['LRUCache', 'PageCache', 'RenderCache', 'FragmentCache',
+           'FragmentCacheExtension', 'conditional']
+
+
+class LRUCache(BaseCache):
+    """In-process cache that stores at most `threshold` items. When the cache
+    is full the least recently used quarter of the items is evicted"""
+
+    def __init__(self, threshold=500, default_timeout=300):
+        BaseCache.__init__(self, default_timeout)
+        self._threshold = threshold
+        #: Maps keys to [expires, value, last use]
+        self._cache = {}
+        self._lock = Lock()
+        self._clock = 0
+
+    def _tick(self):
+        self._clock += 1
+        return self._clock
+
+    def _prune(self):
+        now = time()
+        entries = sorted(self._cache.iteritems(), key=lambda x: x[1][2])
+        for idx, (key, (expires, _, _)) in enumerate(entries):
+            if expires <= now or idx < max(1, len(entries) // 4):
+                del self._cache[key]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time():
+                del self._cache[key]
+                return None
+            entry[2] = self._tick()
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.default_timeout
+        with self._lock:
+            if key not in self._cache and len(self._cache) >= self._threshold:
+                self._prune()
+            self._cache[key] = [time() + timeout, value, self._tick()]
+
+    def add(self, key, value, timeout=None):
+        if self.get(key) is None:
+            self.set(key, value, timeout)
+
+    def delete(self, key):
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class PageCache(object):
+    """Caches whole responses of the decorated views for visitors that are
+    not logged in. The backend is chosen by the `PAGE_CACHE` setting which
+    can be `None`, ``'memory'`` or ``'filesystem'``"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAGE_CACHE', None)
+        app.config.setdefault('PAGE_CACHE_THRESHOLD', 500)
+        app.config.setdefault('PAGE_CACHE_TIMEOUT', 3600)
+        app.config.setdefault('PAGE_CACHE_DIR',
+            os.path.join(os.path.dirname(__file__), 'cache'))
+        backend = app.config['PAGE_CACHE']
+        threshold = app.config['PAGE_CACHE_THRESHOLD']
+        timeout = app.config['PAGE_CACHE_TIMEOUT']
+        if backend == 'memory':
+            app.page_cache = LRUCache(threshold, timeout)
+        elif backend == 'filesystem':
+            app.page_cache = FileSystemCache(app.config['PAGE_CACHE_DIR'],
+                threshold, timeout)
+        elif backend is None:
+            app.page_cache = NullCache()
+        else:
+            raise ValueError('Unknown PAGE_CACHE backend %r' % backend)
+
+    @property
+    def backend(self):
+        backend = getattr(current_app, 'page_cache', None)
+        return backend if backend is not None else NullCache()
+
+    def _get_tokens(self, groups):
+        keys = ['group:%s' % group for group in groups]
+        return dict(zip(groups, self.backend.get_many(*keys)))
+
+    def _new_token(self):
+        return '%r-%s' % (time(), os.urandom(4).encode('hex'))
+
+    def _get_token_time(self, token):
+        try:
+            return float(token.split('-', 1)[0])
+        except ValueError:
+            return 0
+
+    def _get_key(self):
+        key = 'page:%s?%s' % (request.path, request.environ.get(
+            'QUERY_STRING', ''))
+        return key.encode('utf-8')
+
+    def is_active(self):
+        """Only anonymous GET requests without pending flash messages are
+        cached because only their responses are the same for everybody"""
+        return request.method == 'GET' and not session.get('logged_in') \
+            and not session.get('_flashes') \
+            and not isinstance(self.backend, NullCache)
+
+    def depends_on(self, *groups):
+        """Register groups the page of the current request depends on. Call
+        this inside of a view that is decorated with `cached`, before the
+        data of the groups is queried if possible. If the page is going to be
+        cached the current tokens of the groups are taken now and missing
+        tokens are created"""
+        if not hasattr(g, 'page_cache_groups'):
+            g.page_cache_groups = set()
+        g.page_cache_groups.update(groups)
+        tokens = getattr(g, 'page_cache_tokens', None)
+        if tokens is None:
+            return
+        new = [group for group in groups if group not in tokens]
+        for group, token in self._get_tokens(new).iteritems():
+            if token is None:
+                token = self._new_token()
+                self.backend.set('group:%s' % group, token, 
+                    current_app.config['PAGE_CACHE_TIMEOUT'])
+                g.page_cache_created.add(group)
+            tokens[group] = token
+
+    def depends_on_posts(self, posts):
+        """Register the groups of pages that show the posts. The categories
+        are included because their names are shown alongside each post"""
+        for post in posts:
+            self.depends_on('post:%d' % post.id)
+            self.depends_on(*['category:%d' % category.id
+                              for category in post.categories])
+
+    def invalidate(self, *groups):
+        """Make all cached pages that depend on any of the groups stale"""
+        if isinstance(self.backend, NullCache):
+            return
+        token = self._new_token()
+        timeout = current_app.config['PAGE_CACHE_TIMEOUT']
+        for group in groups:
+            self.backend.set('group:%s' % group, token, timeout)
+
+    def get_page(self):
+        """Return the cached response for the current request or `None`"""
+        entry = self.backend.get(self._get_key())
+        if entry is None:
+            return None
+        data, status, mimetype, tokens = entry
+        if None in tokens.values() or self._get_tokens(tokens) != tokens:
+            return None
+        return current_app.response_class(data, status=status,
+            mimetype=mimetype)
+
+    def set_page(self, response, tokens, start):
+        """Store the response of the current request with the tokens that
+        were taken by `depends_on`. Nothing is stored if any of the groups
+        was invalidated after the view was called at `start`"""
+        for group, token in tokens.iteritems():
+            if group not in g.page_cache_created and \
+               self._get_token_time(token) >= start:
+                return
+        self.backend.set(self._get_key(),
+            (response.data, response.status_code, response.mimetype, tokens))
+
+    def cached(self, f):
+        """Decorator that serves the view from the page cache if possible"""
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not self.is_active():
+                return f(*args, **kwargs)
+            response = self.get_page()
+            if response is not None:
+                return response
+            start = time()
+            g.page_cache_tokens = {}
+            g.page_cache_created = set()
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                self.set_page(response, g.page_cache_tokens, start)
+            return response
+        return decorated_function
+
+
+class RenderCache(object):
+    """Cache for markup converted to html. The keys are hashes of the
+    content so that entries never become stale. Entries are kept in a bounded
+    in-process `LRUCache` and, if the `RENDER_CACHE_DIR` setting is given, on
+    disk so that they survive restarts and are shared between processes"""
+    
+    #: Entries cannot become stale so they are kept for a long time
+    timeout = 30 * 24 * 3600
+    
+    def __init__(self, app=None):
+        self.memory = LRUCache(200, self.timeout)
+        self.disk = None
+        if app is not None:
+            self.init_app(app)
+        
+    def init_app(self, app):
+        app.config.setdefault('RENDER_CACHE_THRESHOLD', 200)
+        app.config.setdefault('RENDER_CACHE_DIR', None)
+        threshold = app.config['RENDER_CACHE_THRESHOLD']
+        self.memory = LRUCache(threshold, self.timeout)
+        if app.config['RENDER_CACHE_DIR']:
+            self.disk = FileSystemCache(app.config['RENDER_CACHE_DIR'],
+                threshold * 10, self.timeout)
+        else:
+            self.disk = None
+    
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+        
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+
+class FragmentCacheExtension(Extension):
+    """Adds the ``{% cache name, variant... %}...{% endcache %}`` tag to the
+    templates. The body is rendered once for each combination of the name
+    and the values of the variant and then taken from the `FragmentCache`"""
+    
+    tags = set(['cache'])
+    
+    def parse(self, parser):
+        lineno = parser.stream.next().lineno
+        name = parser.parse_expression()
+        variant = []
+        while parser.stream.skip_if('comma'):
+            variant.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', 
+            [name, nodes.List(variant)]), [], [], body).set_lineno(lineno)
+    
+    def _render(self, name, variant, caller):
+        from simblin.extensions import fragment_cache
+        return fragment_cache.render(name, variant, caller)
+
+
+class FragmentCache(object):
+    """In-process cache for fragments of templates, e.g. the posts of the
+    listings. The variant of a fragment has to contain everything its output
+    depends on, like the modification time of a post, so that entries never
+    become stale in other processes. Invalidating a name only frees the
+    memory early: the name gets a new generation in the backend, so its old
+    fragments are no longer used and are evicted. Enabled by the
+    `FRAGMENT_CACHE` setting"""
+    
+    #: Seconds until an unused fragment expires
+    timeout = 7 * 24 * 3600
+    
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+    
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE', False)
+        app.config.setdefault('FRAGMENT_CACHE_THRESHOLD', 500)
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        if app.config['FRAGMENT_CACHE']:
+            app.fragment_cache = LRUCache(
+                app.config['FRAGMENT_CACHE_THRESHOLD'], self.timeout)
+        else:
+            app.fragment_cache = None
+    
+    @property
+    def backend(self):
+        return getattr(current_app, 'fragment_cache', None)
+    
+    def _get_key(self, backend, name, variant):
+        def part(value):
+            """Represent lists by their items and models by their id"""
+            if isinstance(value, (list, tuple)):
+                return u'[%s]' % u','.join(map(part, value))
+            return unicode(getattr(value, 'id', value))
+        digest = md5(u'\0'.join(map(part, variant)).encode('utf-8'))
+        generation = backend.get('generation:%s' % name) or '0'
+        return '%s@%s:%s' % (name, generation, digest.hexdigest())
+    
+    def render(self, name, variant, caller):
+        """Return the cached fragment or render it by calling `caller`"""
+        backend = self.backend
+        if backend is None:
+            return caller()
+        key = self._get_key(backend, name, variant)
+        fragment = backend.get(key)
+        if fragment is None:
+            fragment = caller()
+            backend.set(key, fragment)
+        return fragment
+    
+    def invalidate(self, *names):
+        """Drop all variants of the fragments with the names"""
+        backend = self.backend
+        if backend is None:
+            return
+        for name in names:
+            backend.set('generation:%s' % name, os.urandom(4).encode('hex'))
+
+
+def conditional(f):
+    """Decorator that answers conditional GET requests of visitors with
+    `304 Not Modified` if nothing changed since the blog's last change. This
+    is decided before the view is called so that neither posts are queried nor
+    templates rendered. Enabled by the `CONDITIONAL_GET` setting"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        from simblin.models import Stamp
+        if not current_app.config['CONDITIONAL_GET'] or \
+           request.method != 'GET' or session.get('logged_in') or \
+           session.get('_flashes'):
+            return f(*args, **kwargs)
+        modified = Stamp.get_datetime()
+        if modified is None:
+            return f(*args, **kwargs)
+        etag = md5('%s?%s@%s' % (request.path.encode('utf-8'), 
+            request.environ.get('QUERY_STRING', ''), 
+            modified.isoformat())).hexdigest()
+        # HTTP dates have a resolution of seconds
+        modified = modified.replace(microsecond=0)
+        if not is_resource_modified(request.environ, quote_etag(etag), 
+                                    last_modified=modified):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.last_modified = modified
+        return response
+    return decorated_function
+
+
+def post_groups(post):
+    """Return all groups of pages which show the post or list it"""
+    date = post.datetime
+    groups = ['post:%d' % post.id, 'index', 'archives', 'feed',
+        'year:%d' % date.year, 'month:%d-%d' % (date.year, date.month),
+        'day:%d-%d-%d' % (date.year, date.month, date.day)]
+    groups.extend('tag:%d' % tag.id for tag in post.tags)
+    groups.extend('category:%d' % category.id for category in post.categories)
+    if not post.categories:
+        groups.append('uncategorized')
+    return groups
+
+
+# ------------- SIGNALS ----------------#
+
+def invalidate_post(post):
+    """Purge the pages that are affected by the changed post"""
+    from simblin.extensions import cache
+    cache.invalidate(*post_groups(post))
+
+
+def drop_post_fragments(post):
+    """Drop the rendered fragments of the changed post"""
+    from simblin.extensions import fragment_cache
+    fragment_cache.invalidate('post:%d' % post.id)
+
+
+def invalidate_category(category):
+    """Purge the archives and the pages that show the category"""
+    from simblin.extensions import cache
+    cache.invalidate('archives', 'category:%d' % category.id)
+
+
+def invalidate_deleted_category(category):
+    """Purge the pages that showed the category and the listing of the
+    uncategorized posts, which may have gained posts"""
+    from simblin.extensions import cache
+    cache.invalidate('archives', 'category:%d' % category.id, 
+                     'uncategorized')
+
+signals.post_created.connect(invalidate_post)
+signals.post_updated.connect(invalidate_post)
+signals.post_deleted.connect(invalidate_post)
+signals.post_updated.connect(drop_post_fragments)
+signals.post_deleted.connect(drop_post_fragments)
+signals.category_created.connect(invalidate_category)
+signals.category_deleted.connect(invalidate_deleted_category)
@@ -2,6 +2,8 @@ import os
 
 BLOG_TITLE = 'Simblin'
 POSTS_PER_PAGE = 5
+# Link the pages of listings by cursors instead of page numbers
+KEYSET_PAGINATION = False
 SECRET_KEY = 'abc'
 # Put the database in the simblin folder
 SQLALCHEMY_DATABASE_URI = 'sqlite:///%s/simblin.db' % os.path.dirname(__file__)
@@ -9,7 +11,37 @@ SQLALCHEMY_ECHO = False
 DEBUG = True
 PORT = 5000
 DISQUS_SHORTNAME = ''
+# Show only the summaries of the posts on the index, tag and category pages
+SUMMARY_LISTINGS = False
+# Cache pages for visitors: None, 'memory' or 'filesystem'
+PAGE_CACHE = None
+PAGE_CACHE_THRESHOLD = 500
+PAGE_CACHE_TIMEOUT = 3600
+# Number of converted posts kept in memory and optionally a directory to keep
+# them on disk, too
+RENDER_CACHE_THRESHOLD = 200
+RENDER_CACHE_DIR = None
+# Keep the rendered posts of the listings in memory
+FRAGMENT_CACHE = False
+FRAGMENT_CACHE_THRESHOLD = 500
+# Answer unchanged pages with 304 Not Modified
+CONDITIONAL_GET = False
+# Read the archives' months from the materialized month index
+MONTH_INDEX = False
+# Leave tags without posts to `python manage.py tidy-tags` instead of deleting
+# them when a post is saved
+DEFERRED_TAG_CLEANUP = False
+# Record the SQL statements and render times of requests for /_stats. In
+# debug mode they are sent in the Server-Timing header, too
+REQUEST_STATS = False
+REQUEST_STATS_SAMPLES = 1000
+# Profile a sample of the requests (and those slower than the threshold in
+# milliseconds) while capturing is started on /_profiler
+PROFILER = False
+PROFILER_SAMPLE_RATE = 0.05
+PROFILER_SLOW_THRESHOLD = None
 
 # For Feed
 AUTHOR = "Batman"
 BLOG_URL = "http://blog.batcave.net"
+FEED_MAX_ENTRIES = 20
@@ -8,8 +8,34 @@
     :copyright: (c) 2010 by Eugen Kiss.
     :license: BSD, see LICENSE for more details.
 """
-from flaskext.sqlalchemy import SQLAlchemy
+from sqlalchemy import orm
+from flaskext import sqlalchemy
+
+from simblin.cache import PageCache, RenderCache, FragmentCache
+from simblin.stats import RequestStats
+from simblin.profiler import Profiler
+
+__all__ = ['db', 'cache', 'render_cache', 'fragment_cache', 'stats', 
+           'profiler']
+
+
+class SQLAlchemy(sqlalchemy.SQLAlchemy):
+    """Creates sessions with the `SessionExtension` instances that are
+    registered in `session_extensions`, e.g. by the models. The session is
+    created like Flask-SQLAlchemy 0.9 does, newer versions are not supported
+    (see setup.py)"""
+    
+    def __init__(self, app=None, use_native_unicode=True):
+        self.session_extensions = []
+        sqlalchemy.SQLAlchemy.__init__(self, app, use_native_unicode)
+        self.session = orm.scoped_session(lambda: orm.create_session(
+            autocommit=False, autoflush=False, bind=self.engine,
+            extension=self.session_extensions))
 
-__all__ = ['db']
 
 db = SQLAlchemy()
+cache = PageCache()
+render_cache = RenderCache()
+fragment_cache = FragmentCache()
+stats = RequestStats()
+profiler = Profiler()
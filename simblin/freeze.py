@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Freeze
+    ~~~~~~~~~~~~~~
+
+    Export the public pages of the blog as static files, e.g. to serve them
+    from a CDN. Every page a visitor can reach is rendered like for a visitor
+    that is not logged in and written to a directory tree:
+
+    - ``/`` and urls that end with a slash become ``index.html`` files,
+    - other pages get the extension of their mimetype (``/post/slug`` becomes
+      ``post/slug.html``, ``/atom`` becomes ``atom.xml``).
+
+    Links between the exported pages and to the static files are rewritten to
+    relative links. Pages that link by cursors are not exported, therefore
+    pages are always linked by their numbers and the exported feed has no
+    links to older entries. Its absolute links point to the exported files.
+
+    The pages are rendered by a pool of threads. SQLite connections cannot be
+    shared between threads, so with SQLite the pages are rendered one after
+    another.
+
+    A manifest records the pages together with the cache groups they depend
+    on (see `simblin.cache`) and the groups of every post. Incremental
+    exports only render the pages that depend on posts that were added,
+    changed or removed since the last export, as well as new pages.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+import os
+import posixpath
+import re
+import shutil
+from datetime import datetime
+from math import ceil
+from urlparse import urlsplit
+from multiprocessing.pool import ThreadPool
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from werkzeug import Client
+from flask import url_for, request, g
+
+from simblin.cache import post_groups
+from simblin.extensions import db
+from simblin.models import Post, Tag, Category
+
+__all__ = ['Freezer']
+
+MANIFEST = 'manifest.json'
+
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+EXTENSIONS = {
+    'text/html': '.html',
+    'application/atom+xml': '.xml',
+}
+
+_link_re = re.compile(r'''((?:href|src|action)=)(["'])(/[^"']*)\2''')
+_paging_link_re = re.compile(r'\s*<link[^>]*rel="(?:next|previous)"[^>]*/>')
+
+
+def record_groups(response):
+    """Send the cache groups of the page along with pages that are frozen"""
+    if request.environ.get('simblin.freeze'):
+        response.headers['X-Cache-Groups'] = ' '.join(
+            sorted(getattr(g, 'page_cache_groups', ())))
+    return response
+
+
+def _pages(count, per_page):
+    return max(1, int(ceil(count / float(per_page))))
+
+
+class Freezer(object):
+    """Renders the public pages of the app into the `destination`
+    directory with a pool of `workers` threads"""
+
+    def __init__(self, app, destination, workers=4):
+        self.app = app
+        self.destination = destination
+        self.workers = workers
+        # Pages that are linked by cursors cannot be exported
+        app.config['KEYSET_PAGINATION'] = False
+        if record_groups not in app.after_request_funcs.get(None, []):
+            app.after_request(record_groups)
+
+    def get_urls(self):
+        """Return the urls of all public pages. Must be called inside of a
+        request context without a logged in admin"""
+        per_page = self.app.config['POSTS_PER_PAGE']
+        visible = Post.query.filter_by(visible=True)
+        urls = ['/atom', url_for('main.show_archives')]
+        def pages(endpoint, count, **values):
+            for page in range(1, _pages(count, per_page) + 1):
+                urls.append(url_for(endpoint, page=page, **values))
+        pages('main.show_posts', visible.count())
+        for post in visible.with_entities(Post._slug):
+            urls.append(url_for('main.show_post', slug=post[0]))
+        for tag in Tag.query.filter(Tag.visible_count > 0):
+            pages('main.show_tag', tag.visible_count, tag=tag.name)
+        for category in Category.query:
+            pages('main.show_category', category.visible_count,
+                  category=category.name)
+        pages('main.show_uncategorized', Post.query.get_uncategorized_count())
+        years, days = {}, {}
+        for month in Post.query.get_months():
+            years[month['year']] = years.get(month['year'], 0) + month['count']
+            pages('main.show_month', month['count'], year=month['year'],
+                  month=month['index'])
+        for year, count in years.iteritems():
+            pages('main.show_year', count, year=year)
+        for post in visible.with_entities(Post.datetime):
+            day = post[0].year, post[0].month, post[0].day
+            days[day] = days.get(day, 0) + 1
+        for (year, month, day), count in days.iteritems():
+            pages('main.show_day', count, year=year, month=month, day=day)
+        return urls
+
+    def render(self, url):
+        """Return the status, mimetype, body and cache groups of the page"""
+        client = Client(self.app, self.app.response_class, use_cookies=False)
+        response = client.get(url, environ_overrides={'simblin.freeze': True})
+        groups = response.headers.get('X-Cache-Groups', '').split()
+        return response.status_code, response.mimetype, response.data, groups
+
+    def get_path(self, url, mimetype):
+        """Return the path of the file of the page relative to the
+        destination"""
+        path = url.lstrip('/')
+        if not path or path.endswith('/'):
+            return path + 'index.html'
+        return path + EXTENSIONS.get(mimetype, '')
+
+    def rewrite_links(self, data, path, paths):
+        """Make the links to exported pages and static files relative to the
+        page's path. `paths` maps urls to the paths of their files"""
+        directory = posixpath.dirname(path) or '.'
+        def replace(match):
+            prefix, quote, link = match.groups()
+            url = urlsplit(link)
+            if url.path in paths:
+                target = paths[url.path]
+            elif url.path.startswith('/static/'):
+                target = url.path.lstrip('/')
+            else:
+                return match.group(0)
+            relative = posixpath.relpath(target, directory)
+            if url.query and url.path.startswith('/static/'):
+                relative += '?' + url.query
+            if url.fragment:
+                relative += '#' + url.fragment
+            return '%s%s%s%s' % (prefix, quote, relative, quote)
+        return _link_re.sub(replace, data)
+
+    def rewrite_feed(self, data, paths):
+        """Point the absolute links of the feed to the exported files and
+        drop the links to older entries which are not exported"""
+        base = self.app.config['BLOG_URL']
+        def replace(match):
+            url = urlsplit(match.group(1))
+            if url.query or url.path not in paths:
+                return match.group(0)
+            return '%s/%s' % (base, paths[url.path])
+        data = _paging_link_re.sub('', data)
+        return re.sub(re.escape(base) + r'''(/[^"'<\s]*)''', replace, data)
+    
+    def copy_static(self):
+        target = os.path.join(self.destination, 'static')
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        shutil.copytree(os.path.join(self.app.root_path, 'static'), target)
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.destination, MANIFEST)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def write_manifest(self, manifest):
+        with open(os.path.join(self.destination, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+    def get_post_groups(self):
+        """Return the cache groups of each visible post by its id"""
+        return dict((str(post.id), sorted(post_groups(post)))
+                    for post in Post.query.filter_by(visible=True)
+                                         .profile('list').with_associations())
+
+    def get_changed_groups(self, manifest, posts):
+        """Return the groups of the posts that were added, changed, hidden or
+        deleted since the export of the manifest"""
+        since = datetime.strptime(manifest['time'], TIME_FORMAT)
+        modified = set(str(row[0]) for row in
+            Post.query.filter(Post.modified >= since).with_entities(Post.id))
+        old = manifest['posts']
+        changed = set()
+        for id in set(old) | set(posts):
+            if id in modified or old.get(id) != posts.get(id):
+                changed.update(old.get(id, ()))
+                changed.update(posts.get(id, ()))
+        return changed
+
+    def freeze(self, incremental=False, log=None):
+        """Export the pages and return the number of written and removed
+        files. Must be called inside of a request context"""
+        started = datetime.now()
+        if not os.path.isdir(self.destination):
+            os.makedirs(self.destination)
+        manifest = incremental and self.read_manifest() or None
+        urls = self.get_urls()
+        posts = self.get_post_groups()
+        if manifest is None:
+            pages = {}
+            outdated = set(urls)
+        else:
+            pages = manifest['pages']
+            changed = self.get_changed_groups(manifest, posts)
+            outdated = set(url for url in urls if url not in pages or
+                           changed.intersection(pages[url]['groups']))
+        removed = [url for url in pages if url not in urls]
+
+        if db.engine.dialect.name == 'sqlite':
+            results = map(self.render, sorted(outdated))
+        else:
+            pool = ThreadPool(self.workers)
+            try:
+                results = pool.map(self.render, sorted(outdated))
+            finally:
+                pool.close()
+                pool.join()
+        rendered = {}
+        for url, (status, mimetype, data, groups) in zip(sorted(outdated),
+                                                         results):
+            if status != 200:
+                if log: log('Skipping %s (%d)' % (url, status))
+                continue
+            rendered[url] = data
+            pages[url] = dict(path=self.get_path(url, mimetype),
+                              groups=groups)
+        for url in removed:
+            path = os.path.join(self.destination, pages.pop(url)['path'])
+            if os.path.exists(path):
+                os.remove(path)
+        paths = dict((url, page['path']) for url, page in pages.iteritems())
+        for url, data in rendered.iteritems():
+            path = pages[url]['path']
+            if path.endswith('.html'):
+                data = self.rewrite_links(data, path, paths)
+            elif path.endswith('.xml'):
+                data = self.rewrite_feed(data, paths)
+            filename = os.path.join(self.destination, *path.split('/'))
+            if not os.path.isdir(os.path.dirname(filename)):
+                os.makedirs(os.path.dirname(filename))
+            with open(filename, 'wb') as f:
+                f.write(data)
+            if log: log('Wrote %s' % path)
+        self.copy_static()
+        self.write_manifest(dict(time=started.strftime(TIME_FORMAT), 
+                                 pages=pages, posts=posts))
+        return len(rendered), len(removed)
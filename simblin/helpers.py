@@ -13,10 +13,16 @@ import unicodedata
 import re
 import os.path
 
+from datetime import datetime, timedelta
+from hashlib import sha1
 from functools import wraps
-from flask import session, url_for, redirect, request, flash
+from jinja2.filters import do_truncate
+from flask import session, url_for, redirect, request, flash, current_app, \
+                  Markup, g
 
 from simblin.lib import markdown2
+from simblin.extensions import render_cache
+from simblin.stats import timer, template_timer
 
 
 def static(filename):
@@ -27,6 +33,28 @@ def static(filename):
     return url_for('.static', filename=filename) + '?' + last_modification
 
 
+def stream_template(template_name, **context):
+    """Render a template as an iterator of strings so that the response can
+    be sent while the template is still being rendered. The stream is consumed
+    after the view returned, that is why it recreates the request context.
+    The time it takes is added to the request's stats when it finishes"""
+    app = current_app._get_current_object()
+    environ = request.environ
+    timings = getattr(g, 'timings', None)
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    def generate():
+        with app.request_context(environ):
+            if timings is not None:
+                # The stats of the request were taken before streaming
+                g.timings = timings
+            with timer('total'):
+                with template_timer():
+                    for chunk in template.stream(context):
+                        yield chunk
+    return generate()
+
+
 def login_required(f):
     """Redirect to login page if user not logged in"""
     @wraps(f)
@@ -59,7 +87,86 @@ def normalize_tags(string):
     return result
 
 
+def year_range(year):
+    """Return the half-open datetime interval [start, end) of a year"""
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+
+def month_range(year, month):
+    """Return the half-open datetime interval [start, end) of a month"""
+    start = datetime(year, month, 1)
+    if month == 12:
+        return start, datetime(year + 1, 1, 1)
+    return start, datetime(year, month + 1, 1)
+
+
+def day_range(year, month, day):
+    """Return the half-open datetime interval [start, end) of a day. Raise
+    ValueError for invalid days, like the other ranges"""
+    start = datetime(year, month, day)
+    try:
+        return start, start + timedelta(days=1)
+    except OverflowError:
+        raise ValueError('The day after %s is out of range' % start.date())
+
+
+def encode_cursor(datetime, id):
+    """Return a url-safe cursor that points at the position of a post in
+    a listing ordered by (datetime, id)"""
+    return '%s-%d' % (datetime.strftime('%Y%m%d%H%M%S%f'), id)
+    
+    
+def decode_cursor(cursor):
+    """Return the (datetime, id) tuple of a cursor created by `encode_cursor`.
+    Raise ValueError if the cursor is malformed"""
+    stamp, id = cursor.split('-', 1)
+    return datetime.strptime(stamp, '%Y%m%d%H%M%S%f'), int(id)
+
+
+#: The extras of markdown2 that are used for the conversion of posts
+MARKDOWN_EXTRAS = ["code-friendly", "code-color", "footnotes"]
+
+
 def convert_markup(string):
-    """Convert the argument from markup to html"""
-    return markdown2.markdown(string, 
-        extras=["code-friendly", "code-color", "footnotes"])
+    """Convert the argument from markup to html. Conversions are cached by a
+    hash of the markup, the extras and the version of markdown2"""
+    if isinstance(string, unicode):
+        string = string.encode('utf-8')
+    key = 'markup:' + sha1('%s\0%s\0%s' % (markdown2.__version__, 
+        ','.join(MARKDOWN_EXTRAS), string)).hexdigest()
+    html = render_cache.get(key)
+    if html is None:
+        with timer('markdown'):
+            html = markdown2.markdown(string.decode('utf-8'), 
+                extras=MARKDOWN_EXTRAS)
+        render_cache.set(key, html)
+    return html
+
+
+#: Markup that ends the summary of a post
+MORE_MARKER = '<!--more-->'
+
+_first_paragraph_re = re.compile(r'<p>.*?</p>', re.DOTALL)
+
+
+def truncate(text, length=255, end='...'):
+    """Shorten the text to at most `length` characters with Jinja's
+    `truncate` filter, which does not count the ellipsis"""
+    if len(text) <= length:
+        return text
+    return do_truncate(text, length - len(end) - 1, False, end)
+
+
+def summarize(markup, html, convert=convert_markup):
+    """Return the html of the summary of a post, its text and whether the
+    post is longer than its summary. The summary is the markup before the
+    `MORE_MARKER` or else the first paragraph"""
+    markup = markup or u''
+    html = html or u''
+    if MORE_MARKER in markup:
+        summary = convert(markup.split(MORE_MARKER, 1)[0])
+    else:
+        match = _first_paragraph_re.search(html)
+        summary = match.group(0) if match else html
+    has_more = summary.strip() != html.strip()
+    return summary, truncate(Markup(summary).striptags()), has_more
@@ -119,6 +119,85 @@ g_escape_table = dict([(ch, _hash_ascii(ch))
 
 
 
+#---- pygments support
+#
+# Looking up lexers walks pygments' plugin registries and formatters are
+# expensive to create, so both are created once and reused. Highlighted
+# snippets are cached, too, because code blocks rarely change when a post is
+# edited.
+
+_pygments_lexers = {}
+_pygments_formatters = {}
+_pygments_snippets = {}
+_pygments_snippet_keys = []
+_PYGMENTS_SNIPPET_CACHE_SIZE = 500
+_HtmlCodeFormatter = None
+
+def _get_pygments_lexer(lexer_name):
+    """Return a shared lexer instance or None if there is no such lexer."""
+    if lexer_name not in _pygments_lexers:
+        try:
+            from pygments import lexers, util
+        except ImportError:
+            return None
+        try:
+            lexer = lexers.get_lexer_by_name(lexer_name)
+        except util.ClassNotFound:
+            lexer = None
+        _pygments_lexers[lexer_name] = lexer
+    return _pygments_lexers[lexer_name]
+
+def _get_pygments_formatter(**formatter_opts):
+    """Return a shared formatter instance for the options."""
+    global _HtmlCodeFormatter
+    key = repr(sorted(formatter_opts.items()))
+    if key not in _pygments_formatters:
+        if _HtmlCodeFormatter is None:
+            import pygments.formatters
+
+            class HtmlCodeFormatter(pygments.formatters.HtmlFormatter):
+                def _wrap_code(self, inner):
+                    """A function for use in a Pygments Formatter which
+                    wraps in <code> tags.
+                    """
+                    yield 0, "<code>"
+                    for tup in inner:
+                        yield tup 
+                    yield 0, "</code>"
+
+                def wrap(self, source, outfile):
+                    """Return the source with a code, pre, and div."""
+                    return self._wrap_div(self._wrap_pre(self._wrap_code(source)))
+
+            _HtmlCodeFormatter = HtmlCodeFormatter
+        _pygments_formatters[key] = _HtmlCodeFormatter(cssclass="codehilite",
+                                                       **formatter_opts)
+    return _pygments_formatters[key]
+
+def _color_with_pygments(codeblock, lexer, **formatter_opts):
+    """Highlight the codeblock. Results are cached per snippet."""
+    import pygments
+    key = (lexer.__class__, repr(sorted(lexer.options.items())),
+           repr(sorted(formatter_opts.items())), codeblock)
+    colored = _pygments_snippets.get(key)
+    if colored is None:
+        formatter = _get_pygments_formatter(**formatter_opts)
+        colored = pygments.highlight(codeblock, lexer, formatter)
+        if len(_pygments_snippet_keys) >= _PYGMENTS_SNIPPET_CACHE_SIZE:
+            _pygments_snippets.pop(_pygments_snippet_keys.pop(0), None)
+        _pygments_snippet_keys.append(key)
+        _pygments_snippets[key] = colored
+    return colored
+
+def reset_pygments_cache():
+    """Forget all shared lexers, formatters and highlighted snippets."""
+    _pygments_lexers.clear()
+    _pygments_formatters.clear()
+    _pygments_snippets.clear()
+    del _pygments_snippet_keys[:]
+
+
+
 #---- exceptions
 
 class MarkdownError(Exception):
@@ -1245,35 +1324,10 @@ class Markdown(object):
         return list_str
 
     def _get_pygments_lexer(self, lexer_name):
-        try:
-            from pygments import lexers, util
-        except ImportError:
-            return None
-        try:
-            return lexers.get_lexer_by_name(lexer_name)
-        except util.ClassNotFound:
-            return None
+        return _get_pygments_lexer(lexer_name)
 
     def _color_with_pygments(self, codeblock, lexer, **formatter_opts):
-        import pygments
-        import pygments.formatters
-
-        class HtmlCodeFormatter(pygments.formatters.HtmlFormatter):
-            def _wrap_code(self, inner):
-                """A function for use in a Pygments Formatter which
-                wraps in <code> tags.
-                """
-                yield 0, "<code>"
-                for tup in inner:
-                    yield tup 
-                yield 0, "</code>"
-
-            def wrap(self, source, outfile):
-                """Return the source with a code, pre, and div."""
-                return self._wrap_div(self._wrap_pre(self._wrap_code(source)))
-
-        formatter = HtmlCodeFormatter(cssclass="codehilite", **formatter_opts)
-        return pygments.highlight(codeblock, lexer, formatter)
+        return _color_with_pygments(codeblock, lexer, **formatter_opts)
 
     def _code_block_sub(self, match):
         codeblock = match.group(1)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Migrations
+    ~~~~~~~~~~~~~~~~~~
+
+    Versioned changes of the database schema. A database created with
+    `db.create_all` already has the newest schema and only needs to be
+    stamped with the newest version. Older databases are brought up to date
+    in place by running the migrations they lack in order. 
+
+    Each migration is a function that receives a connection inside of a
+    transaction. Migrations must be safe to run against a database that
+    already contains (parts of) their changes.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+from sqlalchemy.engine.reflection import Inspector
+
+from simblin.extensions import db
+
+__all__ = ['migrations', 'get_version', 'stamp', 'migrate']
+
+#: The migrations in the order they have to be applied. The version of a
+#: database is the number of migrations applied to it.
+migrations = []
+
+schema_version = db.Table('schema_version', db.Model.metadata,
+    db.Column('version', db.Integer, nullable=False))
+
+
+def migration(f):
+    """Register a migration"""
+    migrations.append(f)
+    return f
+
+
+def _has_column(connection, table, column):
+    inspector = Inspector.from_engine(connection)
+    return column in [c['name'] for c in inspector.get_columns(table)]
+
+
+def _create_missing_indexes(connection, *tables):
+    inspector = Inspector.from_engine(connection)
+    for table in tables:
+        existing = set(index['name'] for index in 
+            inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=connection)
+
+
+@migration
+def create_month_index_and_stamps(connection):
+    """Tables of the materialized month index and the last change stamps"""
+    from simblin.models import Month, Stamp
+    db.Model.metadata.create_all(bind=connection, 
+        tables=[Month.__table__, Stamp.__table__])
+
+
+@migration
+def add_post_modification_time(connection):
+    """Column `posts.modified` for the feed's entry cache"""
+    if not _has_column(connection, 'posts', 'modified'):
+        connection.execute('ALTER TABLE posts ADD COLUMN modified DATETIME')
+        connection.execute('UPDATE posts SET modified = datetime')
+
+
+@migration
+def add_listing_indexes(connection):
+    """Indexes on (visible, datetime), datetime and the association tables"""
+    from simblin.models import Post, post_tags, post_categories
+    _create_missing_indexes(connection, 
+        Post.__table__, post_tags, post_categories)
+
+
+@migration
+def add_post_counters(connection):
+    """Columns with the number of posts of tags and categories"""
+    from simblin.models import Tag, Category, post_tags, post_categories, \
+                               count_posts
+    for table in ['tags', 'categories']:
+        for column in ['visible_count', 'total_count']:
+            if not _has_column(connection, table, column):
+                connection.execute('ALTER TABLE %s ADD COLUMN %s INTEGER '
+                                   'NOT NULL DEFAULT 0' % (table, column))
+    connection.execute(count_posts(Tag.__table__, post_tags, 'tag_id'))
+    connection.execute(count_posts(Category.__table__, post_categories, 
+                                   'category_id'))
+
+
+@migration
+def create_search_index(connection):
+    """Tables of the search index, fill them with `manage.py reindex`"""
+    from simblin.models import search_postings, search_documents
+    db.Model.metadata.create_all(bind=connection, 
+        tables=[search_postings, search_documents])
+
+
+@migration
+def add_post_summaries(connection):
+    """Columns with the summary of a post, filled from the stored html"""
+    from simblin.helpers import summarize
+    from simblin.models import Post
+    for column, type in [('_summary', 'TEXT'), ('_summary_text', 'TEXT'),
+                         ('has_more', 'BOOLEAN')]:
+        if not _has_column(connection, 'posts', column):
+            connection.execute('ALTER TABLE posts ADD COLUMN %s %s' % 
+                               (column, type))
+    table = Post.__table__
+    update = table.update().where(table.c.id==db.bindparam('_id')).values(
+        _summary=db.bindparam('_summary'), 
+        _summary_text=db.bindparam('_summary_text'),
+        has_more=db.bindparam('_has_more'), modified=table.c.modified)
+    rows = []
+    for id, markup, html in connection.execute(
+            db.select([table.c.id, table.c._markup, table.c._html])):
+        summary, text, has_more = summarize(markup, html)
+        rows.append(dict(_id=id, _summary=summary, _summary_text=text,
+                         _has_more=has_more))
+    if rows:
+        connection.execute(update, rows)
+
+
+@migration
+def fill_month_index(connection):
+    """Count the posts of every month into the month index"""
+    from simblin.models import Month
+    table = Month.__table__
+    connection.execute(table.delete())
+    rows = [dict(year=year, month=month, total=total, visible=visible or 0)
+            for year, month, total, visible in 
+            connection.execute(Month.count_posts())]
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def get_version(connection):
+    """Return the schema version of the database. Databases that predate
+    the versioning have version 0"""
+    if not schema_version.exists(bind=connection):
+        return 0
+    return connection.execute(
+        db.select([db.func.max(schema_version.c.version)])).scalar() or 0
+
+
+def stamp(connection, version=None):
+    """Mark the database as being of the given or the newest version"""
+    if version is None:
+        version = len(migrations)
+    schema_version.create(bind=connection, checkfirst=True)
+    connection.execute(schema_version.delete())
+    connection.execute(schema_version.insert(), version=version)
+
+
+def migrate(connection, log=None):
+    """Apply all migrations the database lacks. Return the number of applied
+    migrations"""
+    current = get_version(connection)
+    for version, f in enumerate(migrations[current:], current + 1):
+        if log: log(version, f)
+        transaction = connection.begin()
+        try:
+            f(connection)
+            stamp(connection, version)
+            transaction.commit()
+        except:
+            transaction.rollback()
+            raise
+    return len(migrations) - current
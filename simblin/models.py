@@ -8,12 +8,17 @@
     :copyright: (c) 2010 by Eugen Kiss.
     :license: BSD, see LICENSE for more details.
 """
+import re
 from datetime import datetime
 from werkzeug import check_password_hash, generate_password_hash
-from flask import session
+from flask import session, current_app
+from sqlalchemy.orm.attributes import get_history
+from sqlalchemy.orm.interfaces import SessionExtension
+from sqlalchemy.orm.util import identity_key
 from flaskext.sqlalchemy import BaseQuery
 
-from simblin.helpers import normalize, convert_markup
+from simblin.helpers import normalize, convert_markup, summarize, \
+                            month_range, encode_cursor, decode_cursor
 from simblin.extensions import db
 from simblin import signals
 
@@ -37,26 +42,123 @@ class Admin(db.Model):
         return check_password_hash(self.pw_hash, password)
 
 
+class KeysetPagination(object):
+    """Counterpart of flaskext's `Pagination` for pagination by cursors. There
+    are no page numbers and no total, only links to the newer and older
+    posts"""
+    
+    #: Lets the templates distinguish between the pagination types
+    keyset = True
+    
+    def __init__(self, items, has_prev, has_next):
+        self.items = items
+        self.has_prev = has_prev and bool(items)
+        self.has_next = has_next and bool(items)
+        
+    @property
+    def prev_cursor(self):
+        """The cursor for the page with the newer posts"""
+        if self.has_prev:
+            return encode_cursor(self.items[0].datetime, self.items[0].id)
+        
+    @property
+    def next_cursor(self):
+        """The cursor for the page with the older posts"""
+        if self.has_next:
+            return encode_cursor(self.items[-1].datetime, self.items[-1].id)
+
+
+#: The text columns of a post that are only loaded when needed
+TEXT_COLUMNS = ('_markup', '_html', '_summary', '_summary_text')
+
+#: The text columns that are loaded by each profile of `PostQuery.profile`
+PROFILES = {
+    'list': (),
+    'card': ('_summary', '_summary_text'),
+    'full': ('_html', '_summary', '_summary_text'),
+}
+
+
 class PostQuery(BaseQuery):
     
+    def profile(self, name):
+        """Load only the text columns of the profile: 'list' for titles,
+        slugs and dates, 'card' for the summaries and 'full' for the html.
+        The other columns, like the markup which is only needed for editing,
+        are loaded on first access"""
+        loaded = PROFILES[name]
+        return self.options(*[db.undefer(column) if column in loaded 
+            else db.defer(column) for column in TEXT_COLUMNS])
+    
+    def with_associations(self):
+        """Load the tags and categories of all posts with one query each
+        instead of two queries for every post"""
+        return self.options(db.subqueryload(Post._tags), 
+                            db.subqueryload(Post._categories))
+    
+    def newest_first(self):
+        """Order the posts by date. The id breaks ties"""
+        return self.order_by(Post.datetime.desc(), Post.id.desc())
+    
+    def seek(self, before=None, after=None, per_page=20):
+        """Return a `KeysetPagination` of the posts older than the cursor
+        `before` or newer than the cursor `after`. Unlike OFFSET this needs 
+        not to skip any rows so deep pages are as cheap as the first one. 
+        Raise ValueError if a cursor is malformed"""
+        if after:
+            date, id = decode_cursor(after)
+            query = self.filter(Post.datetime >= date).filter(db.or_(
+                Post.datetime > date, Post.id > id))
+            query = query.order_by(Post.datetime, Post.id)
+            items = query.limit(per_page + 1).all()
+            has_prev = len(items) > per_page
+            items = list(reversed(items[:per_page]))
+            return KeysetPagination(items, has_prev, True)
+        query = self
+        if before:
+            date, id = decode_cursor(before)
+            query = query.filter(Post.datetime <= date).filter(db.or_(
+                Post.datetime < date, Post.id < id))
+        items = query.newest_first().limit(per_page + 1).all()
+        return KeysetPagination(items[:per_page], bool(before), 
+            len(items) > per_page)
+    
+    def between(self, start, end):
+        """Filter the posts of the half-open interval [start, end). Unlike
+        extracting the date's parts this can make use of an index"""
+        return self.filter(Post.datetime >= start).filter(Post.datetime < end)
+    
+    def tagged(self, tag):
+        """Filter the posts that are associated with the tag"""
+        return self.join((post_tags, post_tags.c.post_id==Post.id)) \
+                   .filter(post_tags.c.tag_id==tag.id).reset_joinpoint()
+    
+    def in_category(self, category):
+        """Filter the posts that are in the category"""
+        return self.join((post_categories, 
+                          post_categories.c.post_id==Post.id)) \
+                   .filter(post_categories.c.category_id==category.id) \
+                   .reset_joinpoint()
+    
     def get_months(self):
-        """Group by month and year and return month dict"""
-        from itertools import groupby
+        """Group by month and year and return month dict. Grouping and counting
+        is done by the database so that no post is loaded"""
         from calendar import month_name
-        months = []
-        ordered_posts = self.order_by(Post.id.desc())
+        year = db.extract('year', Post.datetime)
+        month = db.extract('month', Post.datetime)
+        query = self.with_entities(year, month, db.func.count(Post.id))
         if not session.get('logged_in'): 
-            ordered_posts = ordered_posts.filter_by(visible=True)
-        def group_key(item): 
-            return item.datetime.year, item.datetime.month
-        for ((year, month), items) in groupby(ordered_posts, group_key):
-            months.append(dict(
-                year=year,
-                index=month,
-                name=month_name[month],
-                count=len(list(items)),
-            ))
-        return months
+            query = query.filter(Post.visible==True)
+        query = query.group_by(year, month).order_by(year.desc(), month.desc())
+        return [dict(year=y, index=m, name=month_name[m], count=count) 
+            for y, m, count in query]
+    
+    def get_uncategorized_count(self):
+        """Return the number of posts which aren't in any category"""
+        query = self.filter(Post.categories==None)
+        if not session.get('logged_in'): 
+            query = query.filter(Post.visible==True)
+        return query.with_entities(db.func.count(Post.id)).scalar()
     
 
 class Post(db.Model):
@@ -69,8 +171,16 @@ class Post(db.Model):
     _title = db.Column(db.String(255), nullable=False)
     _markup = db.Column(db.Text)
     _html = db.Column(db.Text)
+    #: Html and plain text of the beginning of the post for listings and feeds
+    _summary = db.Column(db.Text)
+    _summary_text = db.Column(db.Text)
+    #: Whether the post goes on after its summary
+    has_more = db.Column(db.Boolean)
     comments_allowed = db.Column(db.Boolean)
     visible = db.Column(db.Boolean)
+    #: Time of the last change of the post's row
+    modified = db.Column(db.DateTime, default=datetime.now, 
+                         onupdate=datetime.now)
     datetime = db.Column(db.DateTime)
     
     # Many to many Post <-> Tag
@@ -91,13 +201,28 @@ class Post(db.Model):
     def _set_title(self, title):
         """Constrain title with slug so slug is never set directly"""
         self._title = title
-        slug = normalize(title)
-        # Make the slug unique
-        while True:
-            entry = Post.query.filter_by(slug=slug).first()
-            if not entry or entry == self: break
-            slug += "-2"
-        self._slug = slug
+        self._slug = self._allocate_slug(normalize(title))
+    
+    def _allocate_slug(self, slug):
+        """Return the slug if it is free, otherwise append the next free
+        number. A numbered slug the post already has is kept while the slug
+        without the number is taken. All taken slugs with the same prefix are
+        fetched at once"""
+        if self._slug == slug:
+            return slug
+        suffix = re.compile(r'^%s-(\d+)$' % re.escape(slug))
+        query = db.session.query(Post._slug).filter(db.or_(Post._slug==slug,
+            Post._slug.like(slug + '-%')))
+        if self.id is not None:
+            query = query.filter(Post.id != self.id)
+        taken = [row[0] for row in query]
+        if slug not in taken:
+            return slug
+        if self._slug is not None and suffix.match(self._slug):
+            return self._slug
+        numbers = [int(match.group(1)) for match in map(suffix.match, taken)
+                   if match]
+        return '%s-%d' % (slug, max([1] + numbers) + 1)
         
     def _get_title(self):
         return self._title
@@ -110,9 +235,14 @@ class Post(db.Model):
     slug = db.synonym("_slug", descriptor=property(_get_slug))
     
     def _set_markup(self, markup):
-        """Constrain markup with html so html is never set directly"""
+        """Constrain markup with html and the summary so they are never set
+        directly. Unchanged markup is not converted again"""
+        if markup == self._markup and self._html is not None:
+            return
         self._markup = markup
         self._html = convert_markup(markup)
+        self._summary, self._summary_text, self.has_more = \
+            summarize(markup, self._html)
         
     def _get_markup(self):
         return self._markup
@@ -125,14 +255,28 @@ class Post(db.Model):
     
     html = db.synonym('_html', descriptor=property(_get_html))
     
+    def _get_summary(self):
+        return self._summary
+    
+    summary = db.synonym('_summary', descriptor=property(_get_summary))
+    
+    def _get_summary_text(self):
+        return self._summary_text
+    
+    summary_text = db.synonym('_summary_text', 
+                              descriptor=property(_get_summary_text))
+    
     def _set_tags(self, taglist):
         """Associate tags with this entry. The taglist is expected to be already
-        normalized without duplicates."""
-        # Remove all previous tags
-        self._tags = []
-        for tag_name in taglist:
-            self._tags.append(Tag.get_or_create(tag_name))
-                
+        normalized without duplicates. Only the associations that changed are
+        removed or added"""
+        tags = Tag.get_or_create_many(taglist)
+        for tag in [tag for tag in self._tags if tag not in tags]:
+            self._tags.remove(tag)
+        for tag in tags:
+            if tag not in self._tags:
+                self._tags.append(tag)
+
         
     def _get_tags(self):
         return self._tags
@@ -145,11 +289,23 @@ class Post(db.Model):
     
     def _set_categories(self, category_ids):
         """Associate categories with this entry by committing a list of
-        category ids"""
-        self._categories = []
+        category ids. All categories are fetched with one query. Raise a
+        `ValueError` if any of the ids does not belong to a category"""
         # Use set to prevent duplicate mappings
-        for id in set(category_ids):
-            self._categories.append(Category.query.get(id))
+        ids = set(int(id) for id in category_ids)
+        categories = []
+        if ids:
+            categories = Category.query.filter(Category.id.in_(ids)) \
+                .order_by(Category.id).all()
+        if len(categories) != len(ids):
+            unknown = ids - set(category.id for category in categories)
+            raise ValueError('Unknown category ids: %s' % 
+                ', '.join(map(str, sorted(unknown))))
+        for category in [c for c in self._categories if c not in categories]:
+            self._categories.remove(category)
+        for category in categories:
+            if category not in self._categories:
+                self._categories.append(category)
         
     def _get_categories(self):
         return self._categories
@@ -182,12 +338,70 @@ post_categories = db.Table('post_categories', db.Model.metadata,
               db.ForeignKey('categories.id', ondelete='CASCADE')))
 
 
+# Indexes for the listings. Every listing filters on the visibility and sorts
+# by date; tag and category pages go through the association tables.
+
+db.Index('ix_posts_visible_datetime', 
+    Post.__table__.c.visible, Post.__table__.c.datetime)
+db.Index('ix_posts_datetime', Post.__table__.c.datetime)
+db.Index('ix_post_tags_tag_post', post_tags.c.tag_id, post_tags.c.post_id)
+db.Index('ix_post_tags_post_tag', post_tags.c.post_id, post_tags.c.tag_id)
+db.Index('ix_post_categories_category_post', 
+    post_categories.c.category_id, post_categories.c.post_id)
+db.Index('ix_post_categories_post_category', 
+    post_categories.c.post_id, post_categories.c.category_id)
+
+
+# Inverted index of the search, see `simblin.search`. The postings hold how
+# often a term occurs in a post, the documents the (weighted) number of terms
+# of each post.
+
+search_postings = db.Table('search_postings', db.Model.metadata,
+    db.Column('term', db.String(64), primary_key=True),
+    db.Column('post_id', db.Integer, 
+              db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('frequency', db.Integer, nullable=False))
+
+search_documents = db.Table('search_documents', db.Model.metadata,
+    db.Column('post_id', db.Integer, 
+              db.ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('length', db.Integer, nullable=False))
+
+db.Index('ix_search_postings_post', search_postings.c.post_id)
+
+
+def count_posts(table, association, key, ids=None):
+    """Return an UPDATE statement that recomputes the columns `visible_count`
+    and `total_count` of the rows of the table with the given ids or of all
+    rows. The association table links the rows by the `key` column to posts"""
+    posts = Post.__table__
+    linked = association.c[key]==table.c.id
+    total = db.select([db.func.count()], linked, from_obj=association)
+    visible = db.select([db.func.count()], db.and_(linked, 
+        posts.c.id==association.c.post_id, posts.c.visible==True),
+        from_obj=[association, posts])
+    statement = table.update().values(total_count=total.as_scalar(),
+        visible_count=visible.as_scalar())
+    if ids is not None:
+        statement = statement.where(table.c.id.in_(ids))
+    return statement
+
+
 class TagQuery(BaseQuery):
     
+    def get_counts(self):
+        """Return a list of (tag, post count) tuples ordered by the tag's name.
+        Tags without (visible) posts are left out"""
+        count = Tag.total_count if session.get('logged_in') else \
+                Tag.visible_count
+        return self.add_columns(count).filter(count > 0) \
+                   .order_by(Tag.name).all()
+    
     def get_maxcount(self):
         """Return the most used tag's number of associations. This is needed
         for the calculation of the tag cloud"""
-        return max(tag.post_count for tag in self) if self.count() else 0
+        counts = [count for tag, count in self.get_counts()]
+        return max(counts) if counts else 0
 
 
 class Tag(db.Model):
@@ -197,6 +411,9 @@ class Tag(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), unique=True, nullable=False)
+    #: Number of visible and of all posts. Kept up to date by `PostCounter`
+    visible_count = db.Column(db.Integer, nullable=False, default=0)
+    total_count = db.Column(db.Integer, nullable=False, default=0)
     
     @classmethod
     def get_or_create(cls, tag_name):
@@ -207,49 +424,309 @@ class Tag(db.Model):
             tag = cls(tag_name)
         return tag
     
+    @classmethod
+    def get_or_create_many(cls, tag_names):
+        """Like `get_or_create` for a list of tag names but with a single
+        query. The tags are returned in the order of the names"""
+        if not tag_names:
+            return []
+        tags = dict((tag.name, tag) for tag in db.session.new 
+                    if isinstance(tag, cls))
+        tags.update((tag.name, tag) for tag in 
+                    cls.query.filter(cls.name.in_(tag_names)))
+        for name in tag_names:
+            if name not in tags:
+                tags[name] = cls(name)
+        return [tags[name] for name in tag_names]
+    
+    @classmethod
+    def delete_orphans(cls, ids=None):
+        """Delete the tags without posts with one statement. If `ids` is given
+        only these tags are examined. Return the ids of the deleted tags"""
+        orphaned = ~db.exists().where(post_tags.c.tag_id==cls.id)
+        query = db.session.query(cls.id).filter(orphaned)
+        if ids is not None:
+            query = query.filter(cls.id.in_(ids))
+        ids = [row[0] for row in query]
+        if ids:
+            db.session.execute(cls.__table__.delete().where(cls.id.in_(ids)))
+        return ids
+    
     def __init__(self, name):
         self.name = name
     
+    @classmethod
+    def recount(cls, ids=None):
+        """Recompute the post counters of the given or of all tags"""
+        db.session.execute(count_posts(cls.__table__, post_tags, 'tag_id', 
+                                       ids))
+    
     @property
     def post_count(self):
         """Return the number of posts with this tag"""
         if not session.get('logged_in'):
-            return self.posts.filter_by(visible=True).count()
-        return self.posts.count()
+            return self.visible_count
+        return self.total_count
     
     def __repr__(self):
         return '<Tag: %s>' % self.name
     
 
+class CategoryQuery(BaseQuery):
+    
+    def get_counts(self):
+        """Return a list of (category, post count) tuples ordered by the post
+        count. Empty categories are included"""
+        count = Category.total_count if session.get('logged_in') else \
+                Category.visible_count
+        return self.add_columns(count) \
+                   .order_by(count.desc(), Category.name).all()
+
+
 class Category(db.Model):
     
     __tablename__ = 'categories'
+    query_class = CategoryQuery
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), unique=True, nullable=False)
+    #: Number of visible and of all posts. Kept up to date by `PostCounter`
+    visible_count = db.Column(db.Integer, nullable=False, default=0)
+    total_count = db.Column(db.Integer, nullable=False, default=0)
     
     def __init__(self, name):
         self.name = name
     
+    @classmethod
+    def recount(cls, ids=None):
+        """Recompute the post counters of the given or of all categories"""
+        db.session.execute(count_posts(cls.__table__, post_categories, 
+                                       'category_id', ids))
+    
     @property
     def post_count(self):
         """Return the number of posts in this category"""
         if not session.get('logged_in'):
-            return self.posts.filter_by(visible=True).count()
-        return self.posts.count()
+            return self.visible_count
+        return self.total_count
     
     def __repr__(self):
         return '<Category: %s>' % self.name
     
     
+class MonthQuery(BaseQuery):
+    
+    def get_months(self):
+        """Return the same month dicts as `PostQuery.get_months` but read them
+        from the materialized index"""
+        from calendar import month_name
+        key = 'total' if session.get('logged_in') else 'visible'
+        query = self.filter(getattr(Month, key) > 0) \
+                    .order_by(Month.year.desc(), Month.month.desc())
+        return [dict(year=m.year, index=m.month, name=month_name[m.month],
+            count=getattr(m, key)) for m in query]
+
+
+class Month(db.Model):
+    """Materialized index of the number of posts per month. It is kept up to
+    date by the post signals"""
+    
+    __tablename__ = 'months'
+    query_class = MonthQuery
+    
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    visible = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __init__(self, year, month):
+        self.year = year
+        self.month = month
+    
+    @classmethod
+    def refresh(cls, year, month):
+        """Recount the posts of a single month. Only the posts of this month
+        are touched by the query"""
+        total, visible = Post.query.with_entities(db.func.count(Post.id), 
+            db.func.sum(db.case([(Post.visible==True, 1)], else_=0))) \
+            .between(*month_range(year, month)).one()
+        entry = cls.query.get((year, month))
+        if not total:
+            if entry: db.session.delete(entry)
+            return
+        if not entry:
+            entry = cls(year, month)
+            db.session.add(entry)
+        entry.total = total
+        entry.visible = visible or 0
+    
+    @staticmethod
+    def count_posts():
+        """Return a select of the year, the month, the number of posts and
+        the number of visible posts of every month"""
+        posts = Post.__table__
+        year = db.extract('year', posts.c.datetime)
+        month = db.extract('month', posts.c.datetime)
+        return db.select([year, month, db.func.count(posts.c.id), 
+            db.func.sum(db.case([(posts.c.visible==True, 1)], else_=0))]) \
+            .group_by(year, month)
+    
+    @classmethod
+    def rebuild(cls):
+        """Recreate the whole index from the posts table"""
+        cls.query.delete()
+        for y, m, total, visible in db.session.execute(cls.count_posts()):
+            entry = cls(y, m)
+            entry.total = total
+            entry.visible = visible or 0
+            db.session.add(entry)
+    
+    def __repr__(self):
+        return '<Month: %d-%02d>' % (self.year, self.month)
+
+
+class Stamp(db.Model):
+    """Named points in time. The stamp 'blog' marks the last change of any
+    public content and is used for conditional requests"""
+    
+    __tablename__ = 'stamps'
+    
+    name = db.Column(db.String(32), primary_key=True)
+    datetime = db.Column(db.DateTime, nullable=False)
+    
+    def __init__(self, name):
+        self.name = name
+    
+    @classmethod
+    def touch(cls, name='blog'):
+        """Set the stamp to the current time (UTC)"""
+        stamp = cls.query.get(name)
+        if not stamp:
+            stamp = cls(name)
+            db.session.add(stamp)
+        stamp.datetime = datetime.utcnow()
+        
+    @classmethod
+    def get_datetime(cls, name='blog'):
+        """Return the time of the stamp or `None` if it was never touched"""
+        stamp = cls.query.get(name)
+        return stamp.datetime if stamp else None
+    
+    def __repr__(self):
+        return '<Stamp: %s>' % self.name
+
+
+class Archive(object):
+    """All numbers needed for the archives page. Each attribute is computed
+    with one aggregate query instead of one query per tag/category"""
+    
+    def __init__(self, materialized_months=False):
+        if materialized_months:
+            self.months = Month.query.get_months()
+        else:
+            self.months = Post.query.get_months()
+        #: List of (tag, post count) tuples
+        self.tags = Tag.query.get_counts()
+        #: List of (category, post count) tuples
+        self.categories = Category.query.get_counts()
+        self.uncategorized_count = Post.query.get_uncategorized_count()
+        #: Needed for calculation of tag cloud
+        self.max_count = max([count for tag, count in self.tags] or [0])
+    
+    
 # ------------- SIGNALS ----------------#
 
-def tidy_tags(post):
-    """Remove tags with zero associations"""
-    for tag in Tag.query.filter_by(posts=None):
-        db.session.delete(tag)
+class TagTidier(SessionExtension):
+    """Delete the tags that lost their last post within the flush that
+    removed the association. Only the tags that deleted posts had or that
+    were taken from posts are examined. If the `DEFERRED_TAG_CLEANUP` setting
+    is true the tags are left to `Tag.delete_orphans`, e.g. run periodically
+    by `manage.py tidy-tags`"""
+    
+    def before_flush(self, session, flush_context, instances):
+        if current_app.config['DEFERRED_TAG_CLEANUP']: return
+        candidates = getattr(session, 'tag_candidates', set())
+        for obj in session.deleted:
+            if isinstance(obj, Post):
+                candidates.update(tag.id for tag in obj._tags)
+        for obj in session.dirty:
+            if isinstance(obj, Post):
+                removed = get_history(obj, '_tags').deleted or ()
+                candidates.update(tag.id for tag in removed)
+        candidates.discard(None)
+        session.tag_candidates = candidates
+    
+    def after_flush(self, session, flush_context):
+        candidates = getattr(session, 'tag_candidates', None)
+        if not candidates: return
+        session.tag_candidates = set()
+        # Loaded instances of the deleted tags must not be used anymore
+        for id in Tag.delete_orphans(candidates):
+            tag = session.identity_map.get(identity_key(Tag, id))
+            if tag is not None:
+                session.expunge(tag)
+
+db.session_extensions.append(TagTidier())
+
+
+class PostCounter(SessionExtension):
+    """Recompute the post counters of the tags and categories of the posts
+    that are flushed. Only posts that were created, deleted, hidden or shown
+    or whose tags or categories changed are considered"""
+    
+    def before_flush(self, session, flush_context, instances):
+        tags, categories = getattr(session, 'counted', (set(), set()))
+        def affected(post, key, recount_all):
+            history = get_history(post, key)
+            if recount_all:
+                return list(getattr(post, key)) + list(history.deleted or ())
+            return list(history.added or ()) + list(history.deleted or ())
+        for obj in session.new | session.deleted:
+            if isinstance(obj, Post):
+                tags.update(obj._tags)
+                categories.update(obj._categories)
+        for obj in session.dirty:
+            if isinstance(obj, Post):
+                toggled = get_history(obj, 'visible').has_changes()
+                tags.update(affected(obj, '_tags', toggled))
+                categories.update(affected(obj, '_categories', toggled))
+        session.counted = (tags, categories)
+    
+    def after_flush_postexec(self, session, flush_context):
+        # New tags and categories are persistent and have ids only now
+        tags, categories = getattr(session, 'counted', (set(), set()))
+        session.counted = (set(), set())
+        for model, objs in [(Tag, tags), (Category, categories)]:
+            ids = [obj.id for obj in objs if obj.id is not None]
+            if not ids: continue
+            model.recount(ids)
+            for obj in objs:
+                if obj in session:
+                    session.expire(obj, ['visible_count', 'total_count'])
+
+db.session_extensions.append(PostCounter())
+
+
+def update_month_index(post):
+    """Recount the month the post belongs to. This happens even while the
+    `MONTH_INDEX` setting is off so that it can be switched on any time"""
+    Month.refresh(post.datetime.year, post.datetime.month)
+    db.session.commit()
+
+signals.post_created.connect(update_month_index)
+signals.post_updated.connect(update_month_index)
+signals.post_deleted.connect(update_month_index)
+
+
+def touch_blog(sender):
+    """Remember the time of the last change for conditional requests. This
+    happens even while `CONDITIONAL_GET` is off so that the stamp is never
+    older than the content when it is switched on"""
+    Stamp.touch()
     db.session.commit()
 
-signals.post_created.connect(tidy_tags)
-signals.post_updated.connect(tidy_tags)
-signals.post_deleted.connect(tidy_tags)
+signals.post_created.connect(touch_blog)
+signals.post_updated.connect(touch_blog)
+signals.post_deleted.connect(touch_blog)
+signals.category_created.connect(touch_blog)
+signals.category_deleted.connect(touch_blog)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Profiler
+    ~~~~~~~~~~~~~~~~
+
+    Profiling of live requests. While capturing is switched on a sample of
+    the requests is run under cProfile and the statistics are written to
+    `PROFILER_DIR`, one pstats file per request named after its endpoint. If
+    `PROFILER_SLOW_THRESHOLD` (in milliseconds) is set, every request is
+    profiled while capturing and the ones that were slower are kept, too.
+
+    Capturing is switched on and off by the admin. The switch is a file in
+    `PROFILER_DIR` so that it applies to all worker processes without a
+    restart. Enabled by the `PROFILER` setting.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import random
+import re
+from time import time
+from cProfile import Profile
+
+from flask import request
+
+__all__ = ['Profiler', 'ProfilerMiddleware']
+
+
+class ProfilerMiddleware(object):
+    """WSGI middleware that profiles requests while the switch file exists"""
+
+    def __init__(self, app, directory, sample_rate=0.05, threshold=None):
+        self.app = app
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+
+    @property
+    def switch(self):
+        return os.path.join(self.directory, 'capture')
+
+    def is_capturing(self):
+        return os.path.exists(self.switch)
+
+    def start(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        open(self.switch, 'w').close()
+
+    def stop(self):
+        if self.is_capturing():
+            os.remove(self.switch)
+
+    def get_dumps(self):
+        """Return the names of the written statistics, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((name for name in os.listdir(self.directory)
+                       if name.endswith('.prof')), reverse=True)
+
+    def __call__(self, environ, start_response):
+        if not self.is_capturing():
+            return self.app(environ, start_response)
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.threshold is None:
+            return self.app(environ, start_response)
+        response = []
+        def run():
+            # The body is consumed inside of the profiler because templates
+            # may be streamed
+            def buffered_start_response(status, headers, exc_info=None):
+                response[:] = [status, headers, exc_info]
+            iterable = self.app(environ, buffered_start_response)
+            try:
+                return list(iterable)
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+        profile = Profile()
+        start = time()
+        body = profile.runcall(run)
+        elapsed = (time() - start) * 1000
+        if sampled or elapsed >= self.threshold:
+            self.dump(profile, environ.get('simblin.endpoint'), start,
+                      elapsed)
+        start_response(*response)
+        return body
+
+    def dump(self, profile, endpoint, start, elapsed):
+        endpoint = re.sub(r'[^\w.]+', '_', endpoint or 'unknown')
+        name = '%s-%d-%dms-%d.prof' % (endpoint, start * 1000, elapsed,
+                                       os.getpid())
+        profile.dump_stats(os.path.join(self.directory, name))
+
+
+class Profiler(object):
+    """Wraps the app into the `ProfilerMiddleware` if the `PROFILER` setting
+    is true. The middleware is available as `app.profiler`"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER', False)
+        app.config.setdefault('PROFILER_DIR',
+            os.path.join(os.path.dirname(__file__), 'profiles'))
+        app.config.setdefault('PROFILER_SAMPLE_RATE', 0.05)
+        app.config.setdefault('PROFILER_SLOW_THRESHOLD', None)
+        app.profiler = None
+        if not app.config['PROFILER']:
+            return
+        app.profiler = ProfilerMiddleware(app.wsgi_app,
+            app.config['PROFILER_DIR'], app.config['PROFILER_SAMPLE_RATE'],
+            app.config['PROFILER_SLOW_THRESHOLD'])
+        app.wsgi_app = app.profiler
+        app.after_request(self.remember_endpoint)
+
+    def remember_endpoint(self, response):
+        """Tell the middleware which endpoint handled the request"""
+        request.environ['simblin.endpoint'] = request.endpoint
+        return response
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Rerender
+    ~~~~~~~~~~~~~~~~
+
+    Regenerate the html and the summaries of all posts from their markup,
+    e.g. after the markdown extras changed or markdown2 was upgraded. The
+    conversion is spread over a process pool and the results are written
+    back in batches.
+    The id of the last written post is kept in a progress file so that an
+    interrupted run can be resumed.
+
+    The pages of the rerendered posts are purged from the page cache. With
+    the ``'memory'`` backend that is only the cache of the process running
+    this, so the server has to be restarted afterwards.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+import os
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+from simblin.extensions import db, cache
+from simblin.helpers import MARKDOWN_EXTRAS, summarize
+from simblin.lib import markdown2
+from simblin.models import Post, Stamp
+
+
+def convert(markup):
+    return markdown2.markdown(markup or u'', extras=MARKDOWN_EXTRAS)
+
+
+def render(args):
+    """Convert the markup of one post and summarize it. Runs in the worker
+    processes"""
+    id, markup = args
+    html = convert(markup)
+    return (id, html) + summarize(markup, html, convert)
+
+
+def read_progress(path):
+    """Return the id of the last post that was written by a former run"""
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except (IOError, ValueError):
+        return 0
+
+
+def write_progress(path, last_id):
+    with open(path, 'w') as f:
+        f.write('%d\n' % last_id)
+
+
+def rerender(processes=None, batch_size=100, progress_path='rerender.progress',
+             log=None):
+    """Rerender all posts with an id greater than the one in the progress
+    file. Return the number of rerendered posts"""
+    last_id = read_progress(progress_path)
+    table = Post.__table__
+    update = table.update().where(table.c.id==db.bindparam('_id')) \
+        .values(_html=db.bindparam('_html'), 
+                _summary=db.bindparam('_summary'),
+                _summary_text=db.bindparam('_summary_text'),
+                has_more=db.bindparam('_has_more'),
+                modified=db.bindparam('_modified'))
+    pool = Pool(processes)
+    total = 0
+    start = time.time()
+    try:
+        while True:
+            batch = db.session.query(Post.id, Post._markup) \
+                .filter(Post.id > last_id).order_by(Post.id) \
+                .limit(batch_size).all()
+            if not batch:
+                break
+            batch_start = time.time()
+            results = pool.map(render, batch)
+            now = datetime.now()
+            db.session.execute(update, [dict(_id=id, _html=html,
+                _summary=summary, _summary_text=text, _has_more=has_more,
+                _modified=now) for id, html, summary, text, has_more 
+                in results])
+            db.session.commit()
+            last_id = batch[-1][0]
+            write_progress(progress_path, last_id)
+            # The feed only depends on its own group
+            cache.invalidate('feed', 
+                             *['post:%d' % result[0] for result in results])
+            total += len(batch)
+            if log: log(total, len(batch) / (time.time() - batch_start))
+    finally:
+        pool.close()
+        pool.join()
+    if total:
+        Stamp.touch()
+        db.session.commit()
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    if log and total:
+        log(total, total / (time.time() - start), done=True)
+    return total
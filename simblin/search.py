@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Search
+    ~~~~~~~~~~~~~~
+
+    Full-text search of the posts. The inverted index lives in the database
+    (`search_postings` and `search_documents`) and is updated for single
+    posts by the post signals. Results are ranked with Okapi BM25. Terms of
+    the title count three times, tags and categories twice.
+
+    Queries are words, optionally with filters like on the search page:
+    ``in:category`` only finds posts in the category and ``[tag]`` only
+    posts with the tag.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+import re
+import unicodedata
+from math import log
+from collections import namedtuple
+
+from flask import Markup
+from flaskext.sqlalchemy import Pagination
+
+from simblin import signals
+from simblin.extensions import db
+from simblin.helpers import normalize
+from simblin.models import Post, Tag, Category, search_postings, \
+                           search_documents
+
+__all__ = ['tokenize', 'parse_query', 'index_post', 'unindex_post',
+           'reindex', 'search']
+
+#: BM25 parameters
+K1 = 1.2
+B = 0.75
+
+#: How often the terms of the fields of a post count
+WEIGHTS = dict(title=3, tags=2, categories=2, body=1)
+
+#: A search result with the highlighted snippet of the post's text
+Hit = namedtuple('Hit', 'post score snippet')
+
+#: Words, but every ideograph and kana is a term of its own because these
+#: scripts do not separate words
+_word_re = re.compile(ur'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff]|'
+                      ur'[^\W\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff]+', 
+                      re.UNICODE)
+_filter_re = re.compile(r'in:(\S+)|\[([^\]]+)\]')
+
+
+def fold(text):
+    """Lowercase the text and strip accents. Letters of other scripts are
+    kept"""
+    return u''.join(c for c in unicodedata.normalize('NFKD', unicode(text))
+                    if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    """Return the terms of the text in order"""
+    return [term[:64] for term in _word_re.findall(fold(text))]
+
+
+def parse_query(query):
+    """Return the terms, the category names and the tag names of a query"""
+    categories, tags = [], []
+    for category, tag in _filter_re.findall(query):
+        if category:
+            categories.append(category)
+        else:
+            tags.append(normalize(tag))
+    return tokenize(_filter_re.sub(' ', query)), categories, tags
+
+
+def get_text(post):
+    """Return the text of the post without markup"""
+    return Markup(post.html or u'').striptags()
+
+
+def analyze(post):
+    """Return a dict with the weighted frequency of each term of the post"""
+    fields = dict(title=post.title, body=get_text(post),
+        tags=u' '.join(tag.name for tag in post.tags),
+        categories=u' '.join(category.name for category in post.categories))
+    frequencies = {}
+    for field, text in fields.iteritems():
+        for term in tokenize(text):
+            frequencies[term] = frequencies.get(term, 0) + WEIGHTS[field]
+    return frequencies
+
+
+def unindex_post(id):
+    db.session.execute(search_postings.delete().where(
+        search_postings.c.post_id==id))
+    db.session.execute(search_documents.delete().where(
+        search_documents.c.post_id==id))
+
+
+def index_post(post):
+    """Replace the entries of the post in the index"""
+    unindex_post(post.id)
+    frequencies = analyze(post)
+    if frequencies:
+        db.session.execute(search_postings.insert(), [dict(term=term,
+            post_id=post.id, frequency=frequency)
+            for term, frequency in frequencies.iteritems()])
+    db.session.execute(search_documents.insert(),
+        dict(post_id=post.id, length=sum(frequencies.itervalues())))
+
+
+def reindex(batch_size=200):
+    """Rebuild the whole index. Return the number of indexed posts"""
+    db.session.execute(search_postings.delete())
+    db.session.execute(search_documents.delete())
+    count = 0
+    last_id = 0
+    while True:
+        posts = Post.query.profile('full').filter(Post.id > last_id) \
+                    .order_by(Post.id).limit(batch_size).all()
+        if not posts:
+            break
+        for post in posts:
+            index_post(post)
+        db.session.commit()
+        count += len(posts)
+        last_id = posts[-1].id
+    return count
+
+
+def find_spans(text, pattern):
+    """Return the spans of the original text whose folded form matches the
+    pattern. Characters that disappear when folded, like combining accents,
+    belong to the span of the preceding character"""
+    folded, origin = [], []
+    for index, char in enumerate(text):
+        part = fold(char)
+        folded.append(part)
+        origin.extend([index] * len(part))
+    origin.append(len(text))
+    return [(origin[match.start()], origin[match.end()])
+            for match in pattern.finditer(u''.join(folded))]
+
+
+def highlight(text, terms, width=200):
+    """Return an excerpt of the text around the first occurrence of any of
+    the folded terms with all occurrences emphasized"""
+    if not terms:
+        end = u'…' if len(text) > width else u''
+        return Markup.escape(text[:width]) + end
+    pattern = re.compile(r'\b(%s)\w*' % '|'.join(map(re.escape, terms)),
+        re.UNICODE)
+    spans = find_spans(text, pattern)
+    start = 0
+    if spans and spans[0][0] > width // 3:
+        start = text.rfind(u' ', 0, spans[0][0] - width // 3) + 1
+    end = start + width
+    parts = []
+    position = start
+    for span_start, span_end in spans:
+        if span_start < start or span_start >= end:
+            continue
+        span_end = min(span_end, end)
+        parts.append(Markup.escape(text[position:span_start]))
+        parts.append(Markup(u'<strong>%s</strong>') %
+                     text[span_start:span_end])
+        position = span_end
+    parts.append(Markup.escape(text[position:end]))
+    return (Markup(u'…') if start else Markup()) + Markup(u'').join(parts) + \
+           (Markup(u'…') if start + width < len(text) else Markup())
+
+
+def score(terms, candidates):
+    """Return a dict with the BM25 score of each of the candidate posts that
+    contain any of the terms"""
+    documents, average = db.session.query(db.func.count(),
+        db.func.avg(search_documents.c.length)).one()
+    if not documents:
+        return {}
+    frequencies = dict(db.session.query(search_postings.c.term,
+        db.func.count()).filter(search_postings.c.term.in_(terms)) \
+        .group_by(search_postings.c.term))
+    idf = dict((term, log((documents - df + 0.5) / (df + 0.5) + 1))
+               for term, df in frequencies.iteritems())
+    postings = db.session.query(search_postings.c.post_id,
+        search_postings.c.term, search_postings.c.frequency,
+        search_documents.c.length) \
+        .filter(search_documents.c.post_id==search_postings.c.post_id) \
+        .filter(search_postings.c.term.in_(terms)) \
+        .filter(search_postings.c.post_id.in_(
+            candidates.with_entities(Post.id).statement))
+    scores = {}
+    for id, term, frequency, length in postings:
+        norm = K1 * (1 - B + B * length / float(average or 1))
+        scores[id] = scores.get(id, 0) + idf[term] * \
+            frequency * (K1 + 1) / (frequency + norm)
+    return scores
+
+
+def search(query, page=1, per_page=10, include_hidden=False):
+    """Return a `Pagination` of `Hit` tuples for the query, best first. Only
+    filtered queries without terms are ordered by date"""
+    terms, categories, tags = parse_query(query)
+    terms = sorted(set(terms))
+    candidates = Post.query
+    if not include_hidden:
+        candidates = candidates.filter_by(visible=True)
+    for name in categories:
+        candidates = candidates.filter(Post._categories.any(name=name))
+    for name in tags:
+        candidates = candidates.filter(Post._tags.any(name=name))
+    if not terms:
+        if not categories and not tags:
+            return Pagination(None, page, per_page, 0, [])
+        pagination = candidates.profile('full').with_associations() \
+                               .newest_first().paginate(page, per_page)
+        pagination.items = [Hit(post, 0, highlight(get_text(post), []))
+                            for post in pagination.items]
+        return pagination
+    scores = score(terms, candidates)
+    ranked = sorted(scores, key=lambda id: (-scores[id], -id))
+    ids = ranked[(page - 1) * per_page:page * per_page]
+    posts = {}
+    if ids:
+        posts = dict((post.id, post) for post in 
+                     Post.query.profile('full').with_associations()
+                               .filter(Post.id.in_(ids)))
+    hits = [Hit(posts[id], scores[id], highlight(get_text(posts[id]), terms))
+            for id in ids if id in posts]
+    return Pagination(None, page, per_page, len(scores), hits)
+
+
+# ------------- SIGNALS ----------------#
+
+def update_index(post):
+    """Index the created or updated post"""
+    index_post(post)
+    db.session.commit()
+
+
+def remove_from_index(post):
+    """Drop the deleted post from the index"""
+    unindex_post(post.id)
+    db.session.commit()
+
+signals.post_created.connect(update_index)
+signals.post_updated.connect(update_index)
+signals.post_deleted.connect(remove_from_index)
@@ -15,3 +15,5 @@ signals = Namespace()
 post_created = signals.signal("entry-created")
 post_updated = signals.signal("entry-updated")
 post_deleted = signals.signal("entry-deleted")
+category_created = signals.signal("category-created")
+category_deleted = signals.signal("category-deleted")
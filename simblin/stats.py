@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Stats
+    ~~~~~~~~~~~~~
+
+    Instrumentation of requests. For every request the number of SQL
+    statements, the time spent in the database, in rendering templates and in
+    converting markup is recorded. In debug mode these numbers are sent in a
+    `Server-Timing` header. The last requests of each endpoint are kept in
+    memory so that percentiles can be shown on the admin's stats page.
+
+    Streamed templates are rendered after the headers were sent. Their time
+    is added to the kept numbers when the stream is finished but it is
+    missing from the `Server-Timing` header.
+
+    Enabled by the `REQUEST_STATS` setting.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from time import time
+
+from jinja2 import Template
+from flask import g, request, current_app, _request_ctx_stack
+from flaskext.sqlalchemy import get_debug_queries
+
+__all__ = ['RequestStats', 'record', 'timer', 'template_timer']
+
+#: The recorded numbers of a request in the order of the `Server-Timing`
+#: header
+METRICS = ['total', 'sql', 'template', 'markdown']
+
+
+def record(name, seconds):
+    """Add the seconds to the timing of the current request if there is
+    one that is instrumented"""
+    if _request_ctx_stack.top is None:
+        return
+    timings = getattr(g, 'timings', None)
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + seconds
+
+
+@contextmanager
+def timer(name):
+    """Record the time spent in the with block"""
+    start = time()
+    try:
+        yield
+    finally:
+        record(name, time() - start)
+
+
+@contextmanager
+def template_timer():
+    """Record the time spent in the with block as template time unless a
+    template is already being rendered. Templates that are rendered by
+    other templates are part of the outer template's time"""
+    if _request_ctx_stack.top is None:
+        yield
+        return
+    depth = getattr(g, 'template_depth', 0)
+    g.template_depth = depth + 1
+    try:
+        if depth:
+            yield
+        else:
+            with timer('template'):
+                yield
+    finally:
+        g.template_depth = depth
+
+
+class TimedTemplate(Template):
+    """Template that records the time it takes to be rendered"""
+
+    def render(self, *args, **kwargs):
+        with template_timer():
+            return Template.render(self, *args, **kwargs)
+
+
+def percentile(values, fraction):
+    """Return the value below which the fraction of the sorted values lie"""
+    if not values:
+        return 0
+    index = int(round(fraction * (len(values) - 1)))
+    return values[index]
+
+
+class RequestStats(object):
+    """Records the numbers of each request and keeps the last
+    `REQUEST_STATS_SAMPLES` requests per endpoint"""
+
+    def __init__(self, app=None):
+        self._samples = {}
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('REQUEST_STATS', False)
+        app.config.setdefault('REQUEST_STATS_SAMPLES', 1000)
+        if not app.config['REQUEST_STATS']:
+            return
+        # The statements are counted by Flask-SQLAlchemy's query recording
+        if app.config.get('SQLALCHEMY_RECORD_QUERIES') is None:
+            app.config['SQLALCHEMY_RECORD_QUERIES'] = True
+        app.jinja_env.template_class = TimedTemplate
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def start_request(self):
+        g.timings = {}
+        g.stats_start = time()
+
+    def finish_request(self, response):
+        if not hasattr(g, 'stats_start'):
+            return response
+        queries = get_debug_queries()
+        timings = g.timings
+        timings['total'] = time() - g.stats_start
+        timings['sql'] = sum(q.end_time - q.start_time for q in queries)
+        self.add(request.endpoint or 'other', len(queries), timings)
+        if current_app.debug:
+            response.headers['Server-Timing'] = ', '.join(
+                '%s;dur=%.1f' % (name, timings.get(name, 0) * 1000)
+                for name in METRICS) + ', queries;desc="%d"' % len(queries)
+        return response
+
+    def add(self, endpoint, queries, timings):
+        """Remember the numbers of a request to the endpoint"""
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(
+                    maxlen=current_app.config['REQUEST_STATS_SAMPLES'])
+            samples.append((queries, timings))
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    def summary(self):
+        """Return a list of dicts with the number of requests and the median,
+        90th and 99th percentile of each metric per endpoint. Times are in
+        milliseconds rounded to one decimal"""
+        with self._lock:
+            samples = [(endpoint, list(entries)) for endpoint, entries
+                       in self._samples.iteritems()]
+        result = []
+        for endpoint, entries in sorted(samples):
+            row = dict(endpoint=endpoint, requests=len(entries))
+            columns = [('queries', [queries for queries, _ in entries])]
+            columns.extend((name, [round(timings.get(name, 0) * 1000, 1)
+                for _, timings in entries]) for name in METRICS)
+            for name, values in columns:
+                values.sort()
+                row[name] = [percentile(values, fraction)
+                             for fraction in (0.5, 0.9, 0.99)]
+            result.append(row)
+        return result
@@ -11,18 +11,23 @@
 """
 import datetime
 
+from sqlalchemy.exc import IntegrityError
 from flask import Module, render_template, session, request, \
-                  flash, redirect, url_for, jsonify, abort
+                  flash, redirect, url_for, jsonify, abort, current_app
 
 from simblin import signals
-from simblin.extensions import db
+from simblin.extensions import db, stats, cache
 from simblin.models import Admin, Post, Category
+from simblin.cache import post_groups
 from simblin.helpers import normalize_tags, convert_markup, login_required, \
                             normalize
 
 
 admin = Module(__name__)
 
+#: How often saving a post is tried if its slug was taken concurrently
+SLUG_ATTEMPTS = 3
+
 
 @admin.route('/does-not-exist')
 def disqus():
@@ -65,28 +70,76 @@ def create_post(slug):
         if title == '':
             flash('You must provide a title', 'error')
             return render_template('admin/compose.html')
-        elif request.form['action'] == 'Publish':
-            post = Post(title, markup, comments_allowed, visible)
-            post.tags = tags
-            post.categories = categories
-            db.session.add(post)
-            db.session.commit()
-            signals.post_created.send(post)
-            flash('New post was successfully posted')
-            return redirect(url_for('main.show_posts'))
-        elif request.form['action'] == 'Update':
-            post.title = title
-            post.markup = markup
-            post.comments_allowed = comments_allowed
-            post.visible = visible
-            post.tags = tags
-            post.categories = categories
-            db.session.commit()
+        elif request.form['action'] in ('Publish', 'Update'):
+            publish = request.form['action'] == 'Publish'
+            # Pages of tags and categories the post is removed from
+            previous = [] if publish else post_groups(post)
+            # The slug is unique. If another process takes the slug between
+            # allocating and committing it the changes are applied again
+            for attempt in range(SLUG_ATTEMPTS):
+                if publish:
+                    post = Post(title, markup, comments_allowed, visible)
+                else:
+                    post.title = title
+                    post.markup = markup
+                    post.comments_allowed = comments_allowed
+                    post.visible = visible
+                post.tags = tags
+                try:
+                    post.categories = categories
+                except ValueError:
+                    return invalid_categories(None if publish else post)
+                if publish:
+                    db.session.add(post)
+                try:
+                    db.session.commit()
+                    break
+                except IntegrityError:
+                    db.session.rollback()
+                    if attempt == SLUG_ATTEMPTS - 1: raise
+            if publish:
+                signals.post_created.send(post)
+                flash('New post was successfully posted')
+                return redirect(url_for('main.show_posts'))
+            cache.invalidate(*previous)
             signals.post_updated.send(post)
             flash('Post was successfully updated')
             return redirect(url_for('main.show_post', slug=post.slug))
         
 
+def invalid_categories(post):
+    """Discard the changes of a submitted post whose categories do not exist
+    (anymore) and show the form again"""
+    db.session.rollback()
+    flash('Some of the selected categories do not exist', 'error')
+    return render_template('admin/compose.html', post=post,
+        categories=Category.query.all())
+        
+
+@admin.route('/_stats')
+@login_required
+def show_stats():
+    """Show the percentiles of the recorded requests per endpoint"""
+    return render_template('admin/stats.html', rows=stats.summary(),
+        enabled=current_app.config['REQUEST_STATS'])
+
+
+@admin.route('/_profiler', methods=['GET', 'POST'])
+@login_required
+def profiler():
+    """Start or stop capturing profiles in all workers"""
+    middleware = current_app.profiler
+    if request.method == 'POST' and middleware is not None:
+        if request.form['action'] == 'Start':
+            middleware.start()
+            flash('Capturing profiles')
+        else:
+            middleware.stop()
+            flash('Stopped capturing profiles')
+        return redirect(url_for('admin.profiler'))
+    return render_template('admin/profiler.html', profiler=middleware)
+
+
 @admin.route('/_delete/<slug>', methods=['GET', 'POST'])
 @login_required
 def delete_post(slug):
@@ -115,6 +168,7 @@ def add_category():
     category = Category(request.form['name'])
     db.session.add(category)
     db.session.commit()
+    signals.category_created.send(category)
     return jsonify(id=category.id, name=category.name,
         url=url_for('main.show_category', category=category.name))
         
@@ -126,6 +180,7 @@ def delete_category():
     category = Category.query.get(request.form['id'])
     db.session.delete(category)
     db.session.commit()
+    signals.category_deleted.send(category)
     return ''
 
 
@@ -9,137 +9,277 @@
     :copyright: (c) 2010 by Eugen Kiss.
     :license: BSD, see LICENSE for more details.
 """
+import datetime
+from calendar import timegm
+
 from flask import Module, current_app, render_template, flash, redirect, \
-                  url_for, abort, session, make_response
-from flaskext.sqlalchemy import Pagination
+                  url_for, abort, session, request, Markup
 
-from simblin.extensions import db
-from simblin.models import Post, Tag, Category
+from simblin.extensions import cache
+from simblin.cache import conditional, LRUCache
+from simblin.helpers import stream_template, year_range, month_range, \
+                            day_range, encode_cursor
+from simblin.lib.rfc3339 import rfc3339
+from simblin.models import Post, Tag, Category, Stamp, Archive
+from simblin.search import search
 
 
 main = Module(__name__)
 
 
+#: Serialized atom entries by post id and modification time
+entry_cache = LRUCache(threshold=500, default_timeout=7 * 24 * 3600)
+
+
+def render_entry(post):
+    """Return the atom entry of the post. Entries are only rendered once for
+    each version of a post"""
+    key = '%d@%s' % (post.id, post.modified)
+    entry = entry_cache.get(key)
+    if entry is None:
+        entry = Markup(render_template('atom_entry.xml', post=post, 
+            rfc3339=rfc3339))
+        entry_cache.set(key, entry)
+    return entry
+
+
 @main.route('/atom')
+@conditional
+@cache.cached
 def atom_feed():
-    """Create an atom feed from the posts"""
-    from simblin.lib.rfc3339 import rfc3339
-    posts = Post.query.filter_by(visible=True).order_by(Post.datetime.desc())
-    updated = posts.first().datetime
-    response = make_response(render_template('atom.xml', posts=posts, 
-        updated=updated, rfc3339=rfc3339))
-    response.mimetype = "application/atom+xml"
-    return response
+    """Create an atom feed from the newest posts. Older posts are reachable
+    by following the feed's `next` links (RFC 5005 paged feeds). The feed is
+    streamed unless it is going to be stored in the page cache anyway"""
+    cache.depends_on('feed')
+    posts = Post.query.filter_by(visible=True).profile('full')
+    try:
+        pagination = posts.seek(request.args.get('before'), 
+            request.args.get('after'), current_app.config['FEED_MAX_ENTRIES'])
+    except ValueError:
+        abort(404)
+    if pagination.items:
+        updated = pagination.items[0].datetime
+    else:
+        # Posts are dated in local time, the stamp in UTC
+        stamp = Stamp.get_datetime()
+        updated = stamp and datetime.datetime.fromtimestamp(
+            timegm(stamp.utctimetuple())) or datetime.datetime.now()
+    render = render_template if cache.is_active() else stream_template
+    feed = render('atom.xml', pagination=pagination, updated=updated, 
+        rfc3339=rfc3339, render_entry=render_entry)
+    return current_app.response_class(feed, mimetype='application/atom+xml')
+
+
+def paginate(posts, page, endpoint, **values):
+    """Paginate the posts newest first and return the pagination together
+    with a function that creates the url of another page. Cursors in the
+    query string are always honored. With `KEYSET_PAGINATION` the pages are
+    linked by cursors instead of numbers so that neither OFFSET nor a total
+    count are needed. Numbered pages, e.g. of old links, are then redirected
+    to their cursors. The tags and categories of the posts are loaded along
+    with them"""
+    per_page = current_app.config['POSTS_PER_PAGE']
+    before = request.args.get('before')
+    after = request.args.get('after')
+    keyset = current_app.config['KEYSET_PAGINATION']
+    endpoint_func = lambda **kwargs: url_for(endpoint, 
+                                             **dict(values, **kwargs))
+    if keyset and page > 1 and not (before or after):
+        # Only the date and id of the last post of the previous page are read
+        last = posts.newest_first().with_entities(Post.datetime, Post.id) \
+                    .offset((page - 1) * per_page - 1).first()
+        if last is None:
+            abort(404)
+        abort(redirect(endpoint_func(before=encode_cursor(*last))))
+    posts = posts.with_associations()
+    if before or after or (keyset and page == 1):
+        try:
+            pagination = posts.seek(before, after, per_page)
+        except ValueError:
+            abort(404)
+    else:
+        pagination = posts.newest_first().paginate(page, per_page)
+    cache.depends_on_posts(pagination.items)
+    return pagination, endpoint_func
+
+
+def summaries(posts):
+    """With `SUMMARY_LISTINGS` listings only show the summaries of the posts.
+    Their markup and html is then not loaded at all"""
+    if current_app.config['SUMMARY_LISTINGS']:
+        return posts.profile('card')
+    return posts.profile('full')
+
 
 @main.route('/', defaults={'page':1})
 @main.route('/<int:page>')
+@conditional
+@cache.cached
 def show_posts(page):
     """Show the latest x blog posts"""
+    cache.depends_on('index')
     if not session.get('logged_in'):
         posts = Post.query.filter_by(visible=True)
     else:
         posts = Post.query
-    pagination = posts.order_by(Post.datetime.desc()).paginate(page=page, 
-        per_page=current_app.config['POSTS_PER_PAGE'])
-    if not pagination.total: flash("No posts so far")
+    pagination, endpoint_func = paginate(summaries(posts), page, 
+        'main.show_posts')
+    if not pagination.items: flash("No posts so far")
     return render_template('posts.html', pagination=pagination,
-        endpoint_func=lambda x: url_for('main.show_posts', page=x))
+        endpoint_func=endpoint_func, 
+        summaries=current_app.config['SUMMARY_LISTINGS'])
         
         
 @main.route('/post/<slug>')
+@conditional
+@cache.cached
 def show_post(slug):
     """Show a specific blog post alone"""
-    post = Post.query.filter_by(slug=slug).first()
+    post = Post.query.profile('full').filter_by(slug=slug).first()
     if not post: abort(404)
     if not session.get('logged_in') and not post.visible: abort(404)
+    cache.depends_on_posts([post])
     return render_template('post.html', post=post)
         
 
 @main.route('/tag/<tag>/', defaults={'page':1})
 @main.route('/tag/<tag>/<int:page>/')
+@conditional
+@cache.cached
 def show_tag(tag, page):
     """Shows all posts with a specific tag"""
-    per_page = current_app.config['POSTS_PER_PAGE']
     tag = Tag.query.filter_by(name=tag).first() or abort(404)
-    posts = tag.posts.order_by(Post.id.desc())
+    cache.depends_on('tag:%d' % tag.id)
+    posts = Post.query.tagged(tag)
     if not session.get('logged_in'): posts = posts.filter_by(visible=True)
-    items = posts.limit(per_page).offset((page - 1) * per_page).all()
-    pagination = Pagination(posts, page=page, per_page=per_page, 
-        total=posts.count(), items=items)
+    pagination, endpoint_func = paginate(summaries(posts), page, 
+        'main.show_tag', tag=tag.name)
     flash("Posts tagged with '%s'" % tag.name)
     return render_template('posts.html', pagination=pagination,
-        endpoint_func=lambda x: url_for('main.show_tag', tag=tag.name, page=x))
+        endpoint_func=endpoint_func, 
+        summaries=current_app.config['SUMMARY_LISTINGS'])
         
         
 @main.route('/category/<category>/', defaults={'page':1})
 @main.route('/category/<category>/<int:page>/')
+@conditional
+@cache.cached
 def show_category(category, page):
     """Shows all posts in a category"""
-    per_page = current_app.config['POSTS_PER_PAGE']
     category = Category.query.filter_by(name=category).first() or abort(404)
-    posts = category.posts.order_by(Post.id.desc())
+    cache.depends_on('category:%d' % category.id)
+    posts = Post.query.in_category(category)
     if not session.get('logged_in'): posts = posts.filter_by(visible=True)
-    items = posts.limit(per_page).offset((page - 1) * per_page).all()
-    pagination = Pagination(posts, page=page, per_page=per_page, 
-        total=posts.count(), items=items)
+    pagination, endpoint_func = paginate(summaries(posts), page, 
+        'main.show_category', category=category.name)
     flash("Posts in category '%s'" % category.name)
     return render_template('posts.html', pagination=pagination,
-        endpoint_func=lambda x: url_for('main.show_category', 
-        category=category.name, page=x))
+        endpoint_func=endpoint_func, 
+        summaries=current_app.config['SUMMARY_LISTINGS'])
                                         
                                         
 @main.route('/uncategorized/', defaults={'page':1})
 @main.route('/uncategorized/<int:page>/')
+@conditional
+@cache.cached
 def show_uncategorized(page):
     """Shows all posts which aren't in any category"""
-    per_page = current_app.config['POSTS_PER_PAGE']
-    posts = Post.query.filter(Post.categories==None)
+    cache.depends_on('uncategorized')
+    posts = Post.query.profile('full').filter(Post.categories==None)
     if not session.get('logged_in'): posts = posts.filter_by(visible=True)
-    items = posts.limit(per_page).offset((page - 1) * per_page).all()
-    pagination = Pagination(posts, page=page, per_page=per_page, 
-        total=posts.count(), items=items)
+    pagination, endpoint_func = paginate(posts, page, 
+        'main.show_uncategorized')
     flash("Uncategorized posts")
     return render_template('posts.html', pagination=pagination,
-        endpoint_func=lambda x: url_for('main.show_uncategorized', page=x))
+        endpoint_func=endpoint_func)
         
         
+@main.route('/<int(fixed_digits=4):year>/', defaults={'page':1})
+@main.route('/<int(fixed_digits=4):year>/page/<int:page>/')
+@conditional
+@cache.cached
+def show_year(year, page):
+    """Show all posts from a specific year"""
+    try:
+        start, end = year_range(year)
+    except ValueError:
+        abort(404)
+    cache.depends_on('year:%d' % year)
+    return show_range(start, end, "Posts from %d" % year, page, 
+        'main.show_year', year=year)
+
+
 @main.route('/<int:year>/<int:month>/', defaults={'page':1})
 @main.route('/<int:year>/<int:month>/<int:page>/')
+@conditional
+@cache.cached
 def show_month(year, month, page):
     """Show all posts from a specific year and month"""
     from calendar import month_name
-    if month not in range(1, 13): abort(404)
-    per_page = current_app.config['POSTS_PER_PAGE']
-    posts = Post.query.filter(db.extract('year', Post.datetime)==year)
-    posts = posts.filter(db.extract('month', Post.datetime)==month)
-    posts = posts.order_by(Post.id.desc()) 
+    try:
+        start, end = month_range(year, month)
+    except ValueError:
+        abort(404)
+    cache.depends_on('month:%d-%d' % (year, month))
+    return show_range(start, end, "Posts from %s %d" % (month_name[month], 
+        year), page, 'main.show_month', year=year, month=month)
+
+
+@main.route('/<int(fixed_digits=4):year>/<int:month>/day/<int:day>/', 
+            defaults={'page':1})
+@main.route('/<int(fixed_digits=4):year>/<int:month>/day/<int:day>/'
+            '<int:page>/')
+@conditional
+@cache.cached
+def show_day(year, month, day, page):
+    """Show all posts from a specific day"""
+    from calendar import month_name
+    try:
+        start, end = day_range(year, month, day)
+    except ValueError:
+        abort(404)
+    cache.depends_on('day:%d-%d-%d' % (year, month, day))
+    return show_range(start, end, "Posts from %d. %s %d" % (day, 
+        month_name[month], year), page, 'main.show_day', year=year, 
+        month=month, day=day)
+
+
+def show_range(start, end, message, page, endpoint, **values):
+    """Show all posts from the half-open datetime interval [start, end)"""
+    posts = Post.query.profile('full').between(start, end)
     if not session.get('logged_in'): posts = posts.filter_by(visible=True)
-    items = posts.limit(per_page).offset((page - 1) * per_page).all()
-    pagination = Pagination(posts, page=page, per_page=per_page, 
-        total=posts.count(), items=items)
-    if items:
-        flash("Posts from %s %d" % (month_name[month], year))
+    pagination, endpoint_func = paginate(posts, page, endpoint, **values)
+    if pagination.items:
+        flash(message)
     else:
         flash("No entries here so far")
     return render_template('posts.html', pagination=pagination,
-        endpoint_func=lambda x: url_for('main.show_month', year=year, month=month, 
-        page=x))
+        endpoint_func=endpoint_func)
         
         
 @main.route('/archives/')
+@conditional
+@cache.cached
 def show_archives():
     """Show the archive. That is recent posts, posts by category etc."""
+    cache.depends_on('archives')
     if not session.get('logged_in'): 
         latest = Post.query.filter_by(visible=True)
     else:
         latest = Post.query
-    latest = latest.order_by(Post.id.desc()).limit(10)
-    months = Post.query.get_months()
-    tags = Tag.query.order_by(Tag.name).all()
-    #: Needed for calculation of tag cloud
-    max_count = Tag.query.get_maxcount()
-    categories = sorted(Category.query.all(), key=lambda x: -x.post_count)
-    uncategorized_count = Post.query.filter(Post.categories==None).count()
-    return render_template('archives.html', latest=latest, tags=tags,
-        categories=categories, uncategorized_count=uncategorized_count, 
-        months=months, max_count=max_count)
+    latest = latest.profile('list').order_by(Post.id.desc()).limit(10)
+    return render_template('archives.html', latest=latest, archive=Archive(
+        materialized_months=current_app.config['MONTH_INDEX']))
+
+
+@main.route('/search')
+def show_search():
+    """Show the posts that match the query, best first"""
+    query = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    pagination = search(query, page, current_app.config['POSTS_PER_PAGE'], 
+        include_hidden=session.get('logged_in', False))
+    endpoint_func = lambda **kwargs: url_for('main.show_search', q=query, 
+        **kwargs)
+    return render_template('search.html', query=query, pagination=pagination,
+        endpoint_func=endpoint_func)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Test Cache
+    ~~~~~~~~~~~~~~~~~~
+
+    Test the caching of rendered pages.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+from flask import session
+
+from simblin.cache import LRUCache
+from simblin.extensions import db, cache, fragment_cache
+from simblin.models import Post
+from simblin.views.main import atom_feed
+
+from nose.tools import assert_equal
+from test.test_views import ViewTestCase
+
+
+def test_lru_eviction():
+    """Test that the least recently used items are evicted first"""
+    cache = LRUCache(threshold=4)
+    for key in 'abcd':
+        cache.set(key, key.upper())
+    assert_equal(cache.get('a'), 'A')
+    cache.set('e', 'E')
+    assert_equal(len(cache), 4)
+    assert_equal(cache.get('b'), None)
+    assert_equal(cache.get('a'), 'A')
+    assert_equal(cache.get('e'), 'E')
+
+
+class TestPageCache(ViewTestCase):
+    
+    PAGE_CACHE = 'memory'
+    
+    def test_invalidation(self):
+        """Test that pages are served from the cache and that only the pages
+        which are affected by a changed post are purged"""
+        self.clear_db()
+        self.register_and_login('barney', 'abc')
+        self.add_post(title='the chronic', tags='drdre', visible=True)
+        self.add_post(title='doggystyle', tags='snoop', visible=True)
+        self.logout()
+        
+        assert 'the chronic' in self.client.get('/').data
+        assert 'the chronic' in self.client.get('/tag/drdre/').data
+        assert 'doggystyle' in self.client.get('/tag/snoop/').data
+        
+        # Change the database behind the cache's back
+        post = Post.query.filter_by(slug='the-chronic').first()
+        post._title = 'the chronic 2001'
+        post2 = Post.query.filter_by(slug='doggystyle').first()
+        post2._title = 'tha doggfather'
+        db.session.commit()
+        assert 'the chronic 2001' not in self.client.get('/').data
+        
+        # Only the pages of the updated post are purged
+        self.login('barney', 'abc')
+        self.update_post(slug='the-chronic', title='the chronic 2001', 
+            tags='drdre', visible=True)
+        self.logout()
+        assert 'the chronic 2001' in self.client.get('/').data
+        assert 'the chronic 2001' in self.client.get('/tag/drdre/').data
+        assert 'doggystyle' in self.client.get('/tag/snoop/').data
+        
+    def test_removed_groups(self):
+        """Test that the pages of a tag are purged when a post is removed
+        from it and that the uncategorized posts are purged when a category
+        is deleted"""
+        self.clear_db()
+        self.app.config['POSTS_PER_PAGE'] = 1
+        self.register_and_login('barney', 'abc')
+        category = self.add_category('music')
+        self.add_post(title='the chronic', tags='rap', visible=True, 
+            categories=[category])
+        self.add_post(title='doggystyle', tags='rap', visible=True)
+        self.logout()
+        assert 'the chronic' in self.client.get('/tag/rap/2/').data
+        rv = self.client.get('/uncategorized/')
+        assert 'doggystyle' in rv.data
+        assert '/uncategorized/2/' not in rv.data
+        
+        self.login('barney', 'abc')
+        self.update_post(slug='doggystyle', title='doggystyle', tags='', 
+            visible=True)
+        self.logout()
+        assert_equal(self.client.get('/tag/rap/2/').status_code, 404)
+        rv = self.client.get('/uncategorized/')
+        assert '/uncategorized/2/' not in rv.data
+        
+        self.login('barney', 'abc')
+        self.delete_category(category)
+        self.logout()
+        assert '/uncategorized/2/' in self.client.get('/uncategorized/').data
+        
+    def test_invalidation_while_rendering(self):
+        """Test that a page is not stored if one of its groups is invalidated
+        after the view read the data of the page"""
+        self.clear_db()
+        db.session.add(Post('the chronic', visible=True))
+        db.session.commit()
+        def depends_on_posts(posts):
+            # The post is changed by another request in the meantime
+            cache.invalidate('post:1')
+            type(cache).depends_on_posts(cache, posts)
+        cache.depends_on_posts = depends_on_posts
+        try:
+            assert 'the chronic' in self.client.get('/post/the-chronic').data
+        finally:
+            del cache.depends_on_posts
+        Post.query.get(1)._title = 'the chronic 2001'
+        db.session.commit()
+        assert 'the chronic 2001' in \
+            self.client.get('/post/the-chronic').data
+        
+    def test_feed(self):
+        """Test that the feed is not streamed if it is cached"""
+        self.clear_db()
+        with self.app.test_request_context('/atom'):
+            assert not atom_feed().is_streamed
+        with self.app.test_request_context('/atom'):
+            session['logged_in'] = True
+            assert atom_feed().is_streamed
+        
+    def test_logged_in(self):
+        """Test that logged in users never see cached pages"""
+        self.clear_db()
+        self.client.get('/')
+        self.register_and_login('barney', 'abc')
+        self.add_post(title='the chronic', visible=None)
+        assert 'the chronic' in self.client.get('/').data
+        self.logout()
+        assert 'the chronic' not in self.client.get('/').data
+
+
+class TestFragmentCache(ViewTestCase):
+    
+    FRAGMENT_CACHE = True
+    
+    def test_fragments(self):
+        """Test that the posts of the listings are rendered once per version
+        and variant and that changed posts are rendered again"""
+        self.clear_db()
+        self.register_and_login('barney', 'abc')
+        self.add_post(title='the chronic', markup='*first*', tags='drdre', 
+            visible=True)
+        self.logout()
+        self.app.fragment_cache.clear()
+        assert 'first' in self.client.get('/').data
+        assert_equal(len(self.app.fragment_cache), 1)
+        # The tag page reuses the fragment of the index
+        db.session.execute(Post.__table__.update().values(_html=u'changed',
+            modified=Post.__table__.c.modified))
+        db.session.commit()
+        assert 'first' in self.client.get('/tag/drdre/').data
+        assert_equal(len(self.app.fragment_cache), 1)
+        
+        self.login('barney', 'abc')
+        rv = self.client.get('/')
+        assert 'changed' in rv.data and 'Edit' in rv.data
+        assert_equal(len(self.app.fragment_cache), 2)
+        self.update_post('the-chronic', title='the chronic', markup='*second*',
+            tags='snoop', visible=True)
+        self.logout()
+        assert 'second' in self.client.get('/tag/snoop/').data
+        
+        # The generations of the names are bounded like the fragments
+        with self.app.test_request_context():
+            fragment_cache.invalidate(*['post:%d' % i for i in range(1000)])
+        assert len(self.app.fragment_cache) <= 500
+        
+        
+class TestConditionalGet(ViewTestCase):
+    
+    CONDITIONAL_GET = True
+    
+    def test_not_modified(self):
+        """Test that unchanged pages are answered with 304 until the next
+        post is published"""
+        self.clear_db()
+        self.register_and_login('barney', 'abc')
+        self.add_post(title='the chronic', visible=True)
+        self.logout()
+        
+        rv = self.client.get('/atom')
+        self.assert_200(rv)
+        etag = rv.headers['ETag']
+        last_modified = rv.headers['Last-Modified']
+        rv = self.client.get('/atom', headers={'If-None-Match': etag})
+        assert_equal(rv.status_code, 304)
+        assert_equal(rv.data, '')
+        rv = self.client.get('/atom', 
+            headers={'If-Modified-Since': last_modified})
+        assert_equal(rv.status_code, 304)
+        rv = self.client.get('/', headers={'If-None-Match': etag})
+        self.assert_200(rv)
+        
+        self.login('barney', 'abc')
+        self.add_post(title='doggystyle', visible=True)
+        self.logout()
+        rv = self.client.get('/atom', headers={'If-None-Match': etag})
+        self.assert_200(rv)
+        assert 'doggystyle' in rv.data
+        
+        # Changes are noticed while conditional requests are switched off
+        etag = rv.headers['ETag']
+        self.app.config['CONDITIONAL_GET'] = False
+        self.login('barney', 'abc')
+        self.add_post(title='tha doggfather', visible=True)
+        self.logout()
+        self.app.config['CONDITIONAL_GET'] = True
+        rv = self.client.get('/atom', headers={'If-None-Match': etag})
+        self.assert_200(rv)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Test Freeze
+    ~~~~~~~~~~~~~~~~~~~
+
+    Test the export of the public pages as static files.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+import os
+import shutil
+import tempfile
+
+from simblin.extensions import db
+from simblin.freeze import Freezer
+from simblin.models import Post
+
+from nose.tools import assert_equal, assert_true, assert_false
+from test.test_views import ViewTestCase
+
+
+class TestFreeze(ViewTestCase):
+    
+    POSTS_PER_PAGE = 2
+    FEED_MAX_ENTRIES = 2
+    
+    def setUp(self):
+        ViewTestCase.setUp(self)
+        self.destination = tempfile.mkdtemp()
+    
+    def tearDown(self):
+        ViewTestCase.tearDown(self)
+        shutil.rmtree(self.destination, ignore_errors=True)
+    
+    def read(self, path):
+        with open(os.path.join(self.destination, path)) as f:
+            return f.read()
+    
+    def test_freeze(self):
+        """Test that all public pages are exported with relative links and
+        that incremental exports only render the affected pages"""
+        self.clear_db()
+        self.register_and_login('barney', 'abc')
+        category_id = self.add_category('cool')
+        self.add_post(title='one', tags='a', visible=True, 
+            categories=[category_id])
+        self.add_post(title='two', tags='a, b', visible=True)
+        self.add_post(title='three', tags='b', visible=True)
+        self.add_post(title='hidden', visible=None)
+        self.logout()
+        
+        freezer = Freezer(self.app, self.destination, workers=2)
+        written, removed = freezer.freeze()
+        for path in ['index.html', '2.html', 'post/one.html', 'atom.xml',
+                     'tag/a/index.html', 'category/cool/index.html',
+                     'uncategorized/index.html', 'archives/index.html',
+                     'static/blog.css']:
+            assert_true(os.path.exists(os.path.join(self.destination, path)),
+                path)
+        assert_false(os.path.exists(os.path.join(self.destination, 
+            'post/hidden.html')))
+        page = self.read('post/one.html')
+        assert 'href="../tag/a/index.html"' in page
+        assert 'href="../static/blog.css?' in page
+        assert 'href="2.html"' in self.read('index.html')
+        feed = self.read('atom.xml')
+        assert '%s/post/three.html' % self.app.config['BLOG_URL'] in feed
+        assert '%s/atom.xml' % self.app.config['BLOG_URL'] in feed
+        assert 'rel="next"' not in feed
+        
+        unaffected = os.path.join(self.destination, 'post/one.html')
+        os.utime(unaffected, (0, 0))
+        post = Post.query.filter_by(slug='three').one()
+        post.markup = 'changed'
+        db.session.commit()
+        written, removed = freezer.freeze(incremental=True)
+        assert 'changed' in self.read('post/three.html')
+        # Only the post and the pages listing it are rendered again
+        assert_equal(os.path.getmtime(unaffected), 0)
+        assert written < len(freezer.get_urls())
+        assert_equal(removed, 0)
+        
+        db.session.delete(post)
+        db.session.commit()
+        written, removed = freezer.freeze(incremental=True)
+        assert_false(os.path.exists(os.path.join(self.destination, 
+            'post/three.html')))
+        assert_false(os.path.exists(os.path.join(self.destination, 
+            '2.html')))
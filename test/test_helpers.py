@@ -8,9 +8,11 @@
     :copyright: (c) 2010 by Eugen Kiss.
     :license: BSD, see LICENSE for more details.
 """
-from nose.tools import assert_equal
+from datetime import datetime
+from nose.tools import assert_equal, assert_raises
 
 from simblin import helpers
+from simblin.lib import markdown2
     
             
 def test_slug_normalizing():
@@ -41,3 +43,47 @@ def test_tags_normalizing():
         helpers.normalize_tags("django, franz und bertha,vil/bil"),
         ['django','franz-und-bertha','vil-bil'])
 
+
+def test_date_ranges():
+    """Test the half-open intervals of the archive views"""
+    assert_equal(helpers.year_range(2010), 
+        (datetime(2010, 1, 1), datetime(2011, 1, 1)))
+    assert_equal(helpers.month_range(2010, 12), 
+        (datetime(2010, 12, 1), datetime(2011, 1, 1)))
+    assert_equal(helpers.month_range(2010, 2), 
+        (datetime(2010, 2, 1), datetime(2010, 3, 1)))
+    assert_equal(helpers.day_range(2010, 2, 28), 
+        (datetime(2010, 2, 28), datetime(2010, 3, 1)))
+    assert_raises(ValueError, helpers.day_range, 9999, 12, 31)
+
+
+def test_markup_conversion_cache():
+    """Test that the same markup is only converted once"""
+    calls = []
+    markdown = markdown2.markdown
+    def counting_markdown(*args, **kwargs):
+        calls.append(args)
+        return markdown(*args, **kwargs)
+    markdown2.markdown = counting_markdown
+    try:
+        html = helpers.convert_markup(u'# Caching \u00fcber alles')
+        assert_equal(helpers.convert_markup(u'# Caching \u00fcber alles'), html)
+        assert_equal(len(calls), 1)
+        helpers.convert_markup(u'# Caching')
+        assert_equal(len(calls), 2)
+    finally:
+        markdown2.markdown = markdown
+
+
+def test_code_coloring_reuse():
+    """Test that lexers and formatters are shared between code blocks"""
+    markdown2.reset_pygments_cache()
+    markup = 'Code:\n\n    :::python\n    print 1\n\nMore:\n\n' \
+             '    :::python\n    print 2\n'
+    html = markdown2.markdown(markup, extras=helpers.MARKDOWN_EXTRAS)
+    assert_equal(html.count('class="codehilite"'), 2)
+    assert_equal(markdown2._pygments_lexers.keys(), ['python'])
+    assert_equal(len(markdown2._pygments_formatters), 1)
+    assert_equal(len(markdown2._pygments_snippets), 2)
+    assert_equal(markdown2.markdown(markup, extras=helpers.MARKDOWN_EXTRAS), 
+        html)
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Test Migrations
+    ~~~~~~~~~~~~~~~~~~~~~~~
+
+    Test the migration of databases that were created by older versions.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+from sqlalchemy.engine.reflection import Inspector
+
+from simblin import migrations
+from simblin.extensions import db
+from simblin.models import Post, Tag, Month
+
+from nose.tools import assert_equal
+from test import TestCase
+
+
+class TestMigrations(TestCase):
+    
+    def test_migrate_old_database(self):
+        """Test that a database of v0.4 is migrated in place"""
+        self.clear_db()
+        connection = db.engine.connect()
+        # Recreate the v0.4 schema of the posts table
+        for table in ['post_tags', 'post_categories', 'posts', 'months', 
+                      'stamps', 'schema_version', 'tags', 'categories']:
+            connection.execute('DROP TABLE IF EXISTS %s' % table)
+        connection.execute('CREATE TABLE posts (id INTEGER NOT NULL, '
+            '_slug VARCHAR(255) NOT NULL, _title VARCHAR(255) NOT NULL, '
+            '_markup TEXT, _html TEXT, comments_allowed BOOLEAN, '
+            'visible BOOLEAN, datetime DATETIME, PRIMARY KEY (id), '
+            'UNIQUE (_slug))')
+        connection.execute("INSERT INTO posts VALUES (1, 't', 't', 'a\n\nb', "
+            "'<p>a</p>\n\n<p>b</p>\n', 1, 1, '2010-10-10 10:10:10.000000')")
+        connection.execute('CREATE TABLE tags (id INTEGER NOT NULL, '
+            'name VARCHAR NOT NULL, PRIMARY KEY (id), UNIQUE (name))')
+        connection.execute('CREATE TABLE categories (id INTEGER NOT NULL, '
+            'name VARCHAR NOT NULL, PRIMARY KEY (id), UNIQUE (name))')
+        connection.execute("INSERT INTO tags VALUES (1, 'cool')")
+        connection.execute('CREATE TABLE post_tags (post_id INTEGER, '
+            'tag_id INTEGER)')
+        connection.execute('INSERT INTO post_tags VALUES (1, 1)')
+        connection.execute('CREATE TABLE post_categories (post_id INTEGER, '
+            'category_id INTEGER)')
+        assert_equal(migrations.get_version(connection), 0)
+        
+        applied = migrations.migrate(connection)
+        assert_equal(applied, len(migrations.migrations))
+        assert_equal(migrations.get_version(connection), applied)
+        inspector = Inspector.from_engine(connection)
+        assert 'months' in inspector.get_table_names()
+        assert 'ix_posts_visible_datetime' in [index['name'] for index in 
+            inspector.get_indexes('posts')]
+        assert 'ix_post_tags_tag_post' in [index['name'] for index in 
+            inspector.get_indexes('post_tags')]
+        assert_equal(migrations.migrate(connection), 0)
+        connection.close()
+        
+        post = Post.query.get(1)
+        assert_equal(post.modified, post.datetime)
+        assert_equal(Month.query.get_months(), Post.query.get_months())
+        assert_equal((post.summary, post.summary_text), ('<p>a</p>', 'a'))
+        assert post.has_more
+        tag = Tag.query.get(1)
+        assert_equal((tag.visible_count, tag.total_count), (1, 1))
@@ -8,11 +8,16 @@
     :copyright: (c) 2010 by Eugen Kiss.
     :license: BSD, see LICENSE for more details.
 """
+from __future__ import with_statement
+import os
 import datetime
+import tempfile
 
 from simblin import signals
+from flaskext.sqlalchemy import get_debug_queries
 from simblin.extensions import db
-from simblin.models import Post, Tag, Category
+from simblin.models import Post, Tag, Category, Month, Archive
+from simblin.rerender import rerender
 
 from nose.tools import assert_equal, assert_true, assert_false
 from test import TestCase
@@ -53,6 +58,38 @@ class TestPosts(TestCase):
         assert_false(Post.query.get(2).visible)
         assert_equal(Post.query.count(), 2)
     
+    def test_summary(self):
+        """Test that the summary is the first paragraph or everything before
+        the more marker"""
+        self.clear_db()
+        post = Post(title='t', markup='*One*\n\nTwo')
+        assert_equal(post.summary, '<p><em>One</em></p>')
+        assert_equal(post.summary_text, 'One')
+        assert_true(post.has_more)
+        post.markup = 'One\n\nTwo\n\n<!--more-->\n\nThree'
+        assert 'Two' in post.summary and 'Three' not in post.summary
+        assert_true(post.has_more)
+        post.markup = 'One'
+        assert_false(post.has_more)
+        post.markup = ' '.join(['word'] * 100)
+        assert len(post.summary_text) <= 255
+        assert post.summary_text.endswith('word ...')
+    
+    def test_profiles(self):
+        """Test that the loading profiles only load their text columns"""
+        self.clear_db()
+        db.session.add(Post(title='t', markup='One\n\nTwo'))
+        db.session.commit()
+        loaded = {}
+        for profile in ['list', 'card', 'full']:
+            db.session.expunge_all()
+            post = Post.query.profile(profile).one()
+            loaded[profile] = sorted(column for column in ['_markup', 
+                '_html', '_summary'] if column in post.__dict__)
+        assert_equal(loaded, dict(list=[], card=['_summary'], 
+            full=['_html', '_summary']))
+        assert_equal(post.markup, 'One\n\nTwo')
+    
     def test_slug_uniqueness(self):
         """Test if posts with the same title result in different slugs"""
         self.clear_db()
@@ -64,7 +101,15 @@ class TestPosts(TestCase):
         posts = Post.query.all()
         assert_equal(posts[0].slug, 't')
         assert_equal(posts[1].slug, 't-2')
-        assert_equal(posts[2].slug, 't-2-2')
+        assert_equal(posts[2].slug, 't-3')
+        
+        # Numbers are not reused and the free one is found with one query
+        db.session.add(Post(title='t 7', markup=''))
+        db.session.commit()
+        queries = len(get_debug_queries())
+        post = Post(title='t', markup='')
+        assert_equal(len(get_debug_queries()) - queries, 1)
+        assert_equal(post.slug, 't-8')
         
     def test_same_slug_after_updating(self):
         """Test if updating a post without changing the title does not result
@@ -76,6 +121,25 @@ class TestPosts(TestCase):
         post.title = 't'
         db.session.commit()
         assert_equal(post.slug, 't')
+        
+    def test_slug_after_retitling(self):
+        """Test that a numbered slug is kept only while the slug without the
+        number is taken by another post"""
+        self.clear_db()
+        first = Post(title='t', markup='')
+        db.session.add(first)
+        db.session.commit()
+        second = Post(title='t', markup='')
+        db.session.add(second)
+        db.session.commit()
+        second.title = 'T'
+        assert_equal(second.slug, 't-2')
+        
+        release = Post(title='Release 2', markup='')
+        db.session.add(release)
+        db.session.commit()
+        release.title = 'Release'
+        assert_equal(release.slug, 'release')
     
     def test_months_view(self):
         """Test the month objects for the archive view"""
@@ -101,6 +165,84 @@ class TestPosts(TestCase):
         assert_equal(months[2]['index'], 1)
         assert_equal(months[2]['count'], 2)
         
+    def test_seek(self):
+        """Test the keyset pagination, especially for posts that share the 
+        same date"""
+        self.clear_db()
+        date = datetime.datetime(2000, 1, 1)
+        for i in range(5):
+            post = Post(title='t', markup='')
+            post.datetime = date if i < 3 else datetime.datetime(2001, 1, i)
+            db.session.add(post)
+            db.session.commit()
+        
+        pagination = Post.query.seek(per_page=2)
+        assert_equal([p.id for p in pagination.items], [5, 4])
+        assert_false(pagination.has_prev)
+        assert_true(pagination.has_next)
+        pagination = Post.query.seek(before=pagination.next_cursor, per_page=2)
+        assert_equal([p.id for p in pagination.items], [3, 2])
+        pagination = Post.query.seek(before=pagination.next_cursor, per_page=2)
+        assert_equal([p.id for p in pagination.items], [1])
+        assert_false(pagination.has_next)
+        pagination = Post.query.seek(after=pagination.prev_cursor, per_page=2)
+        assert_equal([p.id for p in pagination.items], [3, 2])
+        assert_true(pagination.has_prev)
+        
+    def test_month_index(self):
+        """Test if the materialized month index is kept in sync with the
+        posts by the signals"""
+        self.clear_db()
+        posts = []
+        for date in [datetime.datetime(2000, 1, 1), 
+                     datetime.datetime(2000, 1, 31, 23, 59),
+                     datetime.datetime(2000, 2, 1)]:
+            post = Post(title='t', markup='')
+            post.datetime = date
+            db.session.add(post)
+            db.session.commit()
+            signals.post_created.send(post)
+            posts.append(post)
+        assert_equal(Month.query.get_months(), Post.query.get_months())
+        
+        posts[0].visible = False
+        db.session.commit()
+        signals.post_updated.send(posts[0])
+        assert_equal(Month.query.get((2000, 1)).total, 2)
+        assert_equal(Month.query.get((2000, 1)).visible, 1)
+        
+        db.session.delete(posts[2])
+        db.session.commit()
+        signals.post_deleted.send(posts[2])
+        assert_equal(Month.query.get((2000, 2)), None)
+        assert_equal(Month.query.get_months(), Post.query.get_months())
+        
+        Month.rebuild()
+        db.session.commit()
+        assert_equal(Month.query.get_months(), Post.query.get_months())
+
+    def test_rerender(self):
+        """Test if the html of the posts is regenerated in batches and if an
+        interrupted run is resumed"""
+        self.clear_db()
+        for i in range(5):
+            db.session.add(Post(title='t', markup='*%d*' % i))
+            db.session.commit()
+        db.session.execute(Post.__table__.update().values(_html=u'stale',
+            _summary=u'stale'))
+        db.session.commit()
+        progress = os.path.join(tempfile.mkdtemp(), 'progress')
+        with open(progress, 'w') as f:
+            f.write('2\n')
+        assert_equal(rerender(2, 2, progress), 3)
+        assert_false(os.path.exists(progress))
+        db.session.expire_all()
+        posts = Post.query.order_by(Post.id).all()
+        assert_equal([post.html for post in posts[:2]], [u'stale'] * 2)
+        for i, post in enumerate(posts[2:], 2):
+            assert '<em>%d</em>' % i in post.html
+            assert_equal(post.summary, post.html.strip())
+        
         
 class TestTags(TestCase):
     
@@ -144,6 +286,25 @@ class TestTags(TestCase):
         
         assert_equal(Tag.query.count(), 1)
     
+    def test_tag_reassignment(self):
+        """Test if changing the tags of a post resolves all tags at once and
+        keeps the unchanged associations"""
+        self.clear_db()
+        db.session.add(Tag('cool'))
+        post = Post(title='t', markup='')
+        post.tags = ['cool', 'cooler']
+        db.session.add(post)
+        db.session.commit()
+        assert_equal(Tag.query.count(), 2)
+        
+        queries = len(get_debug_queries())
+        post.tags = ['cooler', 'coolest', 'new']
+        assert_equal(len(get_debug_queries()) - queries, 1)
+        db.session.commit()
+        assert_equal([tag.name for tag in post.tags], 
+                     ['cooler', 'coolest', 'new'])
+        assert_equal(Tag.query.filter_by(name='cooler').one().posts.count(), 1)
+    
     def test_tag_tidying(self):
         """Test if tags are automatically deleted when a post is deleted
         and there are no tag associations after that"""
@@ -165,6 +326,67 @@ class TestTags(TestCase):
         assert_equal(Tag.query.count(), 1)
         assert_equal(Tag.query.first().name, 'cool')
     
+    def test_deferred_tag_tidying(self):
+        """Test if tags that were taken from a post are deleted in the same
+        flush or, if deferred, by the sweep"""
+        self.clear_db()
+        post = Post(title='t', markup='')
+        post.tags = ['cool', 'cooler']
+        db.session.add(post)
+        db.session.commit()
+        post.tags = ['cool']
+        db.session.commit()
+        assert_equal([tag.name for tag in Tag.query], ['cool'])
+        
+        self.app.config['DEFERRED_TAG_CLEANUP'] = True
+        post.tags = ['coolest']
+        db.session.commit()
+        assert_equal(Tag.query.count(), 2)
+        Tag.delete_orphans()
+        db.session.commit()
+        assert_equal([tag.name for tag in Tag.query], ['coolest'])
+    
+
+    def test_post_counters(self):
+        """Test if the stored post counters of tags and categories follow
+        creating, hiding, retagging and deleting posts"""
+        self.clear_db()
+        db.session.add(Category('c'))
+        db.session.commit()
+        def counts(model, name):
+            obj = model.query.filter_by(name=name).one()
+            return obj.visible_count, obj.total_count
+        post1 = Post(title='t1', markup='')
+        post1.tags = ['cool', 'cooler']
+        post1.categories = [1]
+        post2 = Post(title='t2', markup='', visible=False)
+        post2.tags = ['cool']
+        post2.categories = [1]
+        db.session.add(post1)
+        db.session.add(post2)
+        db.session.commit()
+        assert_equal(counts(Tag, 'cool'), (1, 2))
+        assert_equal(counts(Tag, 'cooler'), (1, 1))
+        assert_equal(counts(Category, 'c'), (1, 2))
+        
+        post2.visible = True
+        post1.tags = ['cool', 'coolest']
+        db.session.commit()
+        assert_equal(counts(Tag, 'cool'), (2, 2))
+        assert_equal(counts(Tag, 'coolest'), (1, 1))
+        assert_equal(counts(Category, 'c'), (2, 2))
+        
+        db.session.delete(post1)
+        db.session.commit()
+        assert_equal(counts(Tag, 'cool'), (1, 1))
+        assert_equal(counts(Category, 'c'), (1, 1))
+        
+        db.session.execute(Tag.__table__.update().values(visible_count=7))
+        Tag.recount()
+        db.session.commit()
+        db.session.expire_all()
+        assert_equal(counts(Tag, 'cool'), (1, 1))
+    
 
 class TestCategories(TestCase):
     
@@ -198,3 +420,32 @@ class TestCategories(TestCase):
         assert_equal(post2.categories[0].name, 'cool')
         assert_equal(post2.categories[1].name, 'cooler')
     
+    
+class TestArchive(TestCase):
+    
+    def test_counts(self):
+        """Test the aggregated numbers of the archives page for visitors"""
+        self.clear_db()
+        db.session.add(Category('cool'))
+        db.session.add(Category('empty'))
+        db.session.commit()
+        for title, visible, tags, categories in [
+            ('t', True, ['cool', 'cooler'], [1]),
+            ('t2', False, ['cool', 'hidden'], [1]),
+            ('t3', True, ['cool'], []),
+        ]:
+            post = Post(title=title, markup='', visible=visible)
+            post.tags = tags
+            post.categories = categories
+            db.session.add(post)
+            db.session.commit()
+        
+        archive = Archive()
+        assert_equal([(tag.name, count) for tag, count in archive.tags],
+            [('cool', 2), ('cooler', 1)])
+        assert_equal(archive.max_count, 2)
+        assert_equal(
+            [(category.name, count) for category, count in archive.categories],
+            [('cool', 1), ('empty', 0)])
+        assert_equal(archive.uncategorized_count, 1)
+        assert_equal(archive.months[0]['count'], 2)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Test Profiler
+    ~~~~~~~~~~~~~~~~~~~~~
+
+    Test the profiling of live requests.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+import os
+import pstats
+import shutil
+import tempfile
+
+from nose.tools import assert_equal, assert_true, assert_false
+from test.test_views import ViewTestCase
+
+
+class TestProfiler(ViewTestCase):
+    
+    PROFILER = True
+    PROFILER_DIR = tempfile.mkdtemp()
+    PROFILER_SAMPLE_RATE = 1.0
+    
+    def tearDown(self):
+        ViewTestCase.tearDown(self)
+        shutil.rmtree(self.PROFILER_DIR, ignore_errors=True)
+    
+    def test_capture(self):
+        """Test that requests are only profiled while capturing is started
+        and that the dumps are named after the endpoint"""
+        self.clear_db()
+        self.register_and_login('barney', 'abc')
+        profiler = self.app.profiler
+        self.client.get('/')
+        assert_equal(profiler.get_dumps(), [])
+        
+        rv = self.client.post('/_profiler', data=dict(action='Start'),
+            follow_redirects=True)
+        assert 'Capturing profiles' in rv.data
+        assert_true(profiler.is_capturing())
+        self.client.get('/archives/')
+        dumps = [name for name in profiler.get_dumps() 
+                 if name.startswith('main.show_archives-')]
+        assert_equal(len(dumps), 1)
+        pstats.Stats(os.path.join(self.PROFILER_DIR, dumps[0]))
+        
+        self.client.post('/_profiler', data=dict(action='Stop'))
+        assert_false(profiler.is_capturing())
+        count = len(profiler.get_dumps())
+        self.client.get('/archives/')
+        assert_equal(len(profiler.get_dumps()), count)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Test Search
+    ~~~~~~~~~~~~~~~~~~~
+
+    Test the full-text search.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+from simblin.extensions import db
+from simblin.models import Post
+from simblin.search import tokenize, parse_query, highlight, search, reindex
+
+from nose.tools import assert_equal
+from test.test_views import ViewTestCase
+
+
+def test_query_parsing():
+    """Test that filters are separated from the terms"""
+    assert_equal(tokenize(u'Flask, Café & SQL'), ['flask', 'cafe', 'sql'])
+    assert_equal(tokenize(u'Привет, Κόσμε! 日本語 text'), 
+        [u'привет', u'κοσμε', u'日', u'本', u'語', u'text'])
+    assert_equal(parse_query(u'flask in:python [Web Apps] orm'),
+        (['flask', 'orm'], ['python'], ['web-apps']))
+
+
+def test_highlighting():
+    """Test that matches are emphasized and the text is escaped"""
+    text = u'%s <b>Flask</b> and flasks' % (u'word ' * 100)
+    snippet = highlight(text, ['flask'])
+    assert snippet.startswith(u'…')
+    assert u'&lt;b&gt;<strong>Flask</strong>&lt;/b&gt;' in snippet
+    assert u'<strong>flasks</strong>' in snippet
+    
+    snippet = highlight(u'Un Café, un cafe\u0301 ou un CAFÉ', ['cafe'])
+    assert_equal(snippet, u'Un <strong>Café</strong>, un <strong>'
+        u'cafe\u0301</strong> ou un <strong>CAFÉ</strong>')
+
+
+class TestSearch(ViewTestCase):
+    
+    def titles(self, query, **kwargs):
+        return [hit.post.title for hit in search(query, **kwargs).items]
+    
+    def test_search(self):
+        """Test ranking, filters and the updates of the index"""
+        self.clear_db()
+        self.register_and_login('barney', 'abc')
+        category_id = self.add_category('python')
+        self.add_post(title='Flask', markup='A microframework', visible=True,
+            tags='web', categories=[category_id])
+        self.add_post(title='Django', markup='Unlike flask it is big', 
+            visible=True, tags='web')
+        self.add_post(title='Secret flask', markup='', visible=None)
+        
+        assert_equal(self.titles('flask'), ['Flask', 'Django'])
+        assert_equal(sorted(self.titles('flask', include_hidden=True)),
+            ['Django', 'Flask', 'Secret flask'])
+        assert_equal(self.titles('flask in:python'), ['Flask'])
+        assert_equal(self.titles('[web]'), ['Django', 'Flask'])
+        assert_equal(self.titles('[web] big'), ['Django'])
+        assert_equal(self.titles('nothing'), [])
+        self.add_post(title='Hello', markup=u'Привет, мир! 日本語', 
+            visible=True)
+        assert_equal(self.titles(u'МИР'), ['Hello'])
+        assert_equal(self.titles(u'本'), ['Hello'])
+        
+        self.update_post('django', title='Django', markup='big', tags='web',
+            visible=True)
+        assert_equal(self.titles('flask'), ['Flask'])
+        self.delete_post('flask')
+        assert_equal(self.titles('microframework'), [])
+        
+        rv = self.client.get('/search?q=big')
+        assert '<strong>big</strong>' in rv.data
+        assert_equal(reindex(), 3)
+        assert_equal(self.titles('big'), ['Django'])
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+    Simblin Test Stats
+    ~~~~~~~~~~~~~~~~~~
+
+    Test the instrumentation of requests.
+
+    :copyright: (c) 2010 by Eugen Kiss.
+    :license: BSD, see LICENSE for more details.
+"""
+from __future__ import with_statement
+import time
+from flask import g
+
+from simblin.extensions import stats
+
+from nose.tools import assert_equal
+from test.test_views import ViewTestCase
+
+
+class TestStats(ViewTestCase):
+    
+    REQUEST_STATS = True
+    
+    def test_recording(self):
+        """Test that the numbers of requests are recorded per endpoint and
+        shown on the stats page"""
+        self.clear_db()
+        stats.reset()
+        self.register_and_login('barney', 'abc')
+        self.add_post(title='t', markup='*markup*', tags='')
+        rows = dict((row['endpoint'], row) for row in stats.summary())
+        assert rows['admin.create_post']['markdown'][0] > 0
+        
+        stats.reset()
+        self.app.debug = True
+        rv = self.client.get('/')
+        self.app.debug = False
+        timing = rv.headers['Server-Timing']
+        for name in ['total', 'sql', 'template', 'markdown', 'queries']:
+            assert name in timing
+        
+        self.client.get('/')
+        rows = dict((row['endpoint'], row) for row in stats.summary())
+        assert_equal(rows['main.show_posts']['requests'], 2)
+        assert rows['main.show_posts']['queries'][0] > 0
+        assert rows['main.show_posts']['template'][0] > 0
+        
+        rv = self.client.get('/_stats')
+        assert 'main.show_posts' in rv.data
+        assert 'Server-Timing' not in self.client.get('/').headers
+    
+    def test_streamed_feed(self):
+        """Test that the time of a streamed template is recorded when the
+        stream is finished"""
+        self.clear_db()
+        self.register_and_login('barney', 'abc')
+        self.add_post(title='t', markup='*markup*', tags='', visible=True)
+        stats.reset()
+        rv = self.client.get('/atom')
+        assert '<entry>' in rv.data
+        rows = dict((row['endpoint'], row) for row in stats.summary())
+        row = rows['main.atom_feed']
+        assert row['template'][0] > 0
+        assert row['total'][0] >= row['template'][0]
+        
+    def test_nested_templates(self):
+        """Test that a template rendered by another template is not counted
+        twice"""
+        env = self.app.jinja_env
+        inner = env.from_string('{{ sleep() }}')
+        outer = env.from_string('{{ inner() }}')
+        with self.app.test_request_context():
+            g.timings = {}
+            start = time.time()
+            outer.render(inner=lambda: inner.render(
+                sleep=lambda: time.sleep(0.05) or ''))
+            elapsed = time.time() - start
+            assert 0.05 <= g.timings['template'] <= elapsed
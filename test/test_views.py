@@ -12,8 +12,9 @@ from __future__ import with_statement
 import datetime
 import flask
 
-from simblin.extensions import db
+from simblin.extensions import db, stats
 from simblin.models import Post, Tag, Category, post_tags, post_categories, Admin
+from simblin.search import reindex
 
 from nose.tools import assert_equal, assert_true, assert_false
 from test import TestCase
@@ -222,6 +223,22 @@ class TestPost(ViewTestCase):
         
         return post
     
+    def test_unknown_category(self):
+        """Test if a post with a category that does not exist is rejected"""
+        self.clear_db()
+        self.register_and_login('barney', 'abc')
+        category_id = self.add_category('cool')
+        rv = self.add_post(title='t', categories=[category_id, 42])
+        assert 'Some of the selected categories do not exist' in rv.data
+        assert_equal(Post.query.count(), 0)
+        
+        self.add_post(title='t', categories=[category_id])
+        rv = self.update_post('t', title='t2', tags='', categories=[42])
+        assert 'Some of the selected categories do not exist' in rv.data
+        post = Post.query.get(1)
+        assert_equal(post.title, 't')
+        assert_equal([c.name for c in post.categories], ['cool'])
+    
     def test_updating(self):
         """Test the blog post's fields' correctness after updating a post and
         test the proper creation and automatic tidying of tags and tag
@@ -321,6 +338,51 @@ class TestPost(ViewTestCase):
         self.assert_200(rv)
         assert 'Title' in rv.data
         assert 'Title2' not in rv.data
+        
+    def test_keyset_pagination(self):
+        """Test that the listing pages are linked by cursors"""
+        self.clear_db()
+        self.app.config['KEYSET_PAGINATION'] = True
+        self.app.config['POSTS_PER_PAGE'] = 2
+        self.register_and_login('barney', 'abc')
+        for i in range(3):
+            self.add_post(title='Post %d' % i, visible=True)
+        self.logout()
+        
+        rv = self.client.get('/')
+        assert 'Post 2' in rv.data and 'Post 1' in rv.data
+        assert 'Post 0' not in rv.data
+        assert 'newer' not in rv.data
+        cursor = Post.query.get(2).datetime.strftime('%Y%m%d%H%M%S%f') + '-2'
+        assert '/?before=%s' % cursor in rv.data
+        rv = self.client.get('/?before=%s' % cursor)
+        assert 'Post 0' in rv.data
+        assert 'Post 1' not in rv.data
+        assert 'older' not in rv.data
+        rv = self.client.get('/?before=garbage')
+        self.assert_404(rv)
+        # Numbered pages are redirected to their cursors
+        rv = self.client.get('/2')
+        assert_equal(rv.status_code, 302)
+        assert rv.headers['Location'].endswith('/?before=%s' % cursor)
+        self.assert_404(self.client.get('/3'))
+        
+    def test_summary_listings(self):
+        """Test that listings only show the summaries if configured"""
+        self.clear_db()
+        self.register_and_login('barney', 'abc')
+        self.add_post(title='Long', markup='Intro\n\nRest', visible=True,
+            tags='t')
+        self.add_post(title='Short', markup='Only', visible=True)
+        self.logout()
+        assert 'Rest' in self.client.get('/').data
+        
+        self.app.config['SUMMARY_LISTINGS'] = True
+        for url in ['/', '/tag/t/']:
+            rv = self.client.get(url)
+            assert 'Intro' in rv.data and 'Rest' not in rv.data
+            assert_equal(rv.data.count('Read more'), 1)
+        assert 'Rest' in self.client.get('/post/long').data
     
 
 class TestArchives(ViewTestCase):
@@ -330,6 +392,17 @@ class TestArchives(ViewTestCase):
         self.clear_db()
         rv = self.client.get('/archives/')
         self.assert_200(rv)
+        self.register_and_login('barney', 'abc')
+        category_id = self.add_category('rap')
+        self.add_post(title='the chronic', tags='drdre', visible=True,
+            categories=[category_id])
+        self.add_post(title='doggystyle', tags='snoop', visible=None)
+        self.logout()
+        rv = self.client.get('/archives/')
+        self.assert_200(rv)
+        assert 'drdre' in rv.data
+        assert 'snoop' not in rv.data
+        assert 'rap' in rv.data
         
     def test_month_view(self):
         """Test the displaying of the month view"""
@@ -351,8 +424,69 @@ class TestArchives(ViewTestCase):
         rv = self.client.get('/1999/11/')
         self.assert_200(rv)
         assert 'No entries here so far' in rv.data
+        
+    def test_year_and_day_view(self):
+        """Test the displaying of the year and day views"""
+        self.clear_db()
+        for title, date in [('the chronic', datetime.datetime(1992, 12, 15)),
+                            ('the chronic 2001', datetime.datetime(1999, 11, 16)),
+                            ('doggystyle', datetime.datetime(1993, 11, 23))]:
+            post = Post(title, visible=True)
+            post.datetime = date
+            db.session.add(post)
+            db.session.commit()
+        rv = self.client.get('/1999/')
+        self.assert_200(rv)
+        assert 'the chronic 2001' in rv.data
+        assert 'doggystyle' not in rv.data
+        rv = self.client.get('/1993/11/day/23/')
+        self.assert_200(rv)
+        assert 'doggystyle' in rv.data
+        assert 'Posts from 23. November 1993' in rv.data
+        rv = self.client.get('/1993/11/day/24/')
+        assert 'No entries here so far' in rv.data
+        rv = self.client.get('/1993/11/day/31/')
+        self.assert_404(rv)
+        self.assert_404(self.client.get('/9999/12/day/31/'))
+        # Years have four digits
+        self.assert_404(self.client.get('/5/'))
 
 
+class TestFeed(ViewTestCase):
+    
+    def test_feed(self):
+        """Test that the feed is bounded, streamed and paged"""
+        self.clear_db()
+        rv = self.client.get('/atom')
+        self.assert_200(rv)
+        assert '<entry>' not in rv.data
+        
+        self.app.config['FEED_MAX_ENTRIES'] = 2
+        self.register_and_login('barney', 'abc')
+        for i in range(3):
+            self.add_post(title='Post %d' % i, visible=True)
+        self.logout()
+        
+        rv = self.client.get('/atom')
+        assert rv.is_streamed
+        assert_equal(rv.data.count('<entry>'), 2)
+        assert 'Post 2' in rv.data and 'Post 0' not in rv.data
+        assert 'rel="next"' in rv.data
+        assert 'rel="previous"' not in rv.data
+        cursor = Post.query.get(2).datetime.strftime('%Y%m%d%H%M%S%f') + '-2'
+        rv = self.client.get('/atom?before=%s' % cursor)
+        assert_equal(rv.data.count('<entry>'), 1)
+        assert 'Post 0' in rv.data
+        assert 'rel="next"' not in rv.data
+        assert 'rel="previous"' in rv.data
+        
+        self.login('barney', 'abc')
+        self.update_post(slug='post-2', title='Post 2 updated', tags='', 
+            visible=True)
+        self.logout()
+        assert 'Post 2 updated' in self.client.get('/atom').data
+        
+        
 class TestTag(ViewTestCase):
     
     def test_view(self):
@@ -431,3 +565,36 @@ class TestCategory(ViewTestCase):
         rv = self.delete_category(1)
         print rv
         assert_equal(Category.query.count(), 0)
+
+
+class TestQueryCounts(ViewTestCase):
+    
+    REQUEST_STATS = True
+    
+    def test_listings(self):
+        """Test that the number of queries of the listings does not depend on
+        the number of posts on a page"""
+        self.clear_db()
+        category = Category('c')
+        for i in range(12):
+            post = Post('post %d' % i, 'text', visible=True)
+            post.datetime = datetime.datetime(2010, 10, 10, i)
+            post.tags = ['t', 'u']
+            if i % 2:
+                post._categories = [category]
+            db.session.add(post)
+            db.session.commit()
+        reindex()
+        urls = ['/', '/tag/t/', '/category/c/', '/uncategorized/', '/2010/', 
+                '/2010/10/', '/2010/10/day/10/', '/atom', '/search?q=post']
+        counts = []
+        for per_page in [2, 6]:
+            self.app.config['POSTS_PER_PAGE'] = per_page
+            self.app.config['FEED_MAX_ENTRIES'] = per_page
+            stats.reset()
+            for url in urls:
+                self.assert_200(self.client.get(url))
+            counts.append(dict((row['endpoint'], row['queries'][0]) 
+                               for row in stats.summary()))
+        assert_equal(len(counts[0]), len(urls))
+        assert_equal(counts[0], counts[1])